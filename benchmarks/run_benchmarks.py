@@ -0,0 +1,250 @@
+"""Benchmark suite for galmask.
+
+Runs `galmask` on synthetic fields of increasing size and source density, for all modes, without deblending, with full
+and central-only deblending, and with local maxima removal on and off, on stacks of small cutouts (one image at a time
+and with the vectorized stack engine), as well as the label selection and convolution utilities. Wall times (median
+over repeats, per stage for galmask) and peak traced memory are written as JSON, and can be compared against a
+baseline produced by an earlier run to catch performance regressions. Run it as a module from the repository root:
+
+    python -m benchmarks.run_benchmarks --quick --output baseline.json
+    python -m benchmarks.run_benchmarks --quick --output results.json --baseline baseline.json
+
+`benchmarks/baseline.json` holds the `--quick` results of the current release, on the machine described in its
+"meta" field. Times depend on the machine, so regenerate a baseline from the release on your own machine before
+comparing against it, and update the stored one along with the release.
+
+The time needed to import galmask in a fresh interpreter, paid by every worker process and CLI invocation, is also
+measured. The exit code is 1 if any benchmark is slower than its baseline by more than the tolerance, or if the import
+time exceeds the import budget.
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from itertools import product
+from statistics import median
+
+import numpy as np
+from astropy.convolution import Gaussian2DKernel
+
+from photutils.datasets import make_noise_image
+
+from galmask.convolution import CONVOLVE_METHODS, Convolver
+from galmask.galmask import GalMasker
+from galmask.profiling import StageProfiler
+from galmask.utils import getCenterLabelRegion
+
+QUICK_SIZES = (64, 256)
+FULL_SIZES = (64, 128, 256, 512, 1024, 2048, 4096)
+IMPORT_MODULES = ("galmask.galmask", "galmask.batch", "galmask.cli")
+PARAMS = dict(npixels=5, nlevels=32, nsigma=3., contrast=0.001, min_distance=1, num_peaks=10, num_peaks_per_label=3)
+
+
+def make_field(size, density, seed=0):
+    """Synthetic square field with a galaxy at the center and Gaussian sources at random positions on a noisy background.
+
+    :param size: Side of the field in pixels.
+    :type size: int
+    :param density: No. of background sources per pixel.
+    :type density: float
+    :param seed: Random seed, defaults to 0.
+    :type seed: int, optional
+
+    :return image: Synthetic field.
+    :rtype: numpy.ndarray
+
+    """
+    rng = np.random.default_rng(seed)
+    image = make_noise_image((size, size), distribution="gaussian", mean=5.0, stddev=1.0, seed=seed)
+    sources = [(size / 2, size / 2, 100.0, max(size / 32, 2.0))]
+    n_sources = int(density * size * size)
+    sources += zip(
+        rng.uniform(0, size, n_sources), rng.uniform(0, size, n_sources), rng.uniform(10, 80, n_sources), rng.uniform(1.0, 3.0, n_sources)
+    )
+    for y0, x0, amplitude, sigma in sources:  # Render each source on a stamp of +- 5 sigma only.
+        half = int(np.ceil(5 * sigma))
+        ys = slice(max(int(y0) - half, 0), min(int(y0) + half + 1, size))
+        xs = slice(max(int(x0) - half, 0), min(int(x0) + half + 1, size))
+        y, x = np.ogrid[ys, xs]
+        image[ys, xs] += amplitude * np.exp(-((x - x0) ** 2 + (y - y0) ** 2) / (2 * sigma ** 2))
+    return image
+
+def make_label_grid(n_labels, spacing=8):
+    """Label map with `n_labels` square labels on a regular grid."""
+    side = int(np.ceil(np.sqrt(n_labels)))
+    labels = np.zeros((side * spacing, side * spacing), dtype=np.int32)
+    for k in range(n_labels):
+        i, j = divmod(k, side)
+        labels[i * spacing + 1:(i + 1) * spacing - 2, j * spacing + 1:(j + 1) * spacing - 2] = k + 1
+    return labels
+
+def measure(func, repeat):
+    """Median wall time over `repeat` runs and peak traced memory of a single run, in seconds and bytes.
+
+    A first untimed run performs the lazy imports of galmask's dependencies and warms up caches.
+    """
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return median(times), peak_memory
+
+def time_galmask_stages(masker, image, repeat):
+    """Median wall time of each stage of a galmask call, see `galmask.profiling.StageProfiler`."""
+    masker.profiler = StageProfiler()
+    try:
+        for _ in range(repeat):
+            masker(image)
+    finally:
+        summary, masker.profiler = masker.profiler.summary(), None
+    return {row["stage"]: row["p50"] for row in summary}
+
+def time_import(module, repeat):
+    """Median wall time of importing `module` in a fresh interpreter, excluding the interpreter startup."""
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    return median(
+        float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+        for _ in range(repeat)
+    )
+
+def bench_import(modules, repeat):
+    for module in modules:
+        yield {"id": f"import[module={module}]", "benchmark": "import", "module": module, "time": time_import(module, repeat)}
+
+def bench_galmask(sizes, densities, modes, repeat):
+    for size, density, mode, deblend, remove_local_max in product(sizes, densities, modes, (False, True, "central"), (False, True)):
+        image = make_field(size, density)
+        masker = GalMasker(**PARAMS, mode=mode, deblend=deblend, remove_local_max=remove_local_max)
+        result = {
+            "id": f"galmask[size={size},density={density},mode={mode},deblend={deblend},remove_local_max={remove_local_max}]",
+            "benchmark": "galmask", "size": size, "density": density, "mode": mode, "deblend": deblend,
+            "remove_local_max": remove_local_max
+        }
+        try:
+            result["time"], result["peak_memory"] = measure(lambda: masker(image), repeat)
+            result["stages"] = time_galmask_stages(masker, image, repeat)
+        except ValueError as exc:  # E.g. no source left after local maxima removal.
+            result["error"] = str(exc)
+        yield result
+
+def mask_each(masker, images):
+    """Mask the images one at a time, as `GalMasker.iter_stack` does for a stack."""
+    for image in images:
+        try:
+            masker(image)
+        except ValueError:
+            pass
+
+def bench_stack(stack_sizes, modes, repeat, size=64):
+    for n_images, mode in product(stack_sizes, modes):
+        stack = np.stack([make_field(size, 5e-4, seed=seed) for seed in range(n_images)])
+        masker = GalMasker(**PARAMS, mode=mode)
+        engines = {"loop": lambda: mask_each(masker, stack), "stack": lambda: list(masker.iter_stack(stack))}
+        for engine, func in engines.items():
+            result = {
+                "id": f"stack[n_images={n_images},size={size},mode={mode},engine={engine}]", "benchmark": "stack",
+                "n_images": n_images, "size": size, "mode": mode, "engine": engine
+            }
+            result["time"], result["peak_memory"] = measure(func, repeat)
+            yield result
+
+def bench_label_selection(label_counts, repeat):
+    for n_labels in label_counts:
+        labels = make_label_grid(n_labels)
+        result = {"id": f"getCenterLabelRegion[n_labels={n_labels}]", "benchmark": "getCenterLabelRegion", "n_labels": n_labels}
+        result["time"], result["peak_memory"] = measure(lambda: getCenterLabelRegion(labels), repeat)
+        yield result
+
+def bench_convolution(sizes, repeat):
+    kernels = {"3x3": Gaussian2DKernel(1, x_size=3, y_size=3).array, "15x15": Gaussian2DKernel(3, x_size=15, y_size=15).array}
+    for size, (kernel_name, kernel), method in product(sizes, kernels.items(), CONVOLVE_METHODS):
+        image = make_field(size, 0.0)
+        convolver = Convolver(kernel, method=method)
+        result = {
+            "id": f"convolve[size={size},kernel={kernel_name},method={method}]", "benchmark": "convolve", "size": size,
+            "kernel": kernel_name, "method": method
+        }
+        result["time"], result["peak_memory"] = measure(lambda: convolver(image), repeat)
+        yield result
+
+def compare(results, baseline, tolerance):
+    """Return the results slower than their baseline by more than `tolerance` (relative), with their baseline time."""
+    baseline_times = {result["id"]: result["time"] for result in baseline["results"] if "time" in result}
+    return [
+        (result, baseline_times[result["id"]]) for result in results
+        if "time" in result and result["id"] in baseline_times and result["time"] > (1 + tolerance) * baseline_times[result["id"]]
+    ]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--quick", action="store_true", help=f"Only benchmark sizes {QUICK_SIZES} (default: {FULL_SIZES}).")
+    parser.add_argument("--sizes", type=int, nargs="+", help="Image sizes to benchmark, overrides --quick.")
+    parser.add_argument("--densities", type=float, nargs="+", default=[5e-4, 2e-3], help="Background source densities (sources per pixel).")
+    parser.add_argument("--modes", nargs="+", default=["0", "1", "2"], help="galmask modes to benchmark.")
+    parser.add_argument("--stack-sizes", type=int, nargs="+", default=[16, 256], help="No. of 64x64 images for the stack engine benchmark.")
+    parser.add_argument("--label-counts", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Label counts for the label selection benchmark.")
+    parser.add_argument("--repeat", type=int, default=5, help="No. of timed runs per benchmark (default: 5).")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare against the results stored in this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown against the baseline (default: 0.25).")
+    parser.add_argument("--import-budget", type=float, default=0.5, help="Maximum time in seconds to import each galmask module (default: 0.5).")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = args.sizes or (QUICK_SIZES if args.quick else FULL_SIZES)
+
+    results = []
+    for result in (
+        *bench_import(IMPORT_MODULES, args.repeat),
+        *bench_galmask(sizes, args.densities, args.modes, args.repeat),
+        *bench_stack(args.stack_sizes, args.modes, args.repeat),
+        *bench_label_selection(args.label_counts, args.repeat),
+        *bench_convolution(sizes, args.repeat)
+    ):
+        results.append(result)
+        if "error" in result:
+            status = f"error: {result['error']}"
+        else:
+            status = f"{result['time'] * 1e3:10.2f} ms"
+            if "peak_memory" in result:
+                status += f" {result['peak_memory'] / 2**20:9.2f} MiB"
+        print(f"{result['id']:<90} {status}", flush=True)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    over_budget = [result for result in results if result["benchmark"] == "import" and result["time"] > args.import_budget]
+    for result in over_budget:
+        print(f"OVER BUDGET {result['id']}: {result['time'] * 1e3:.2f} ms vs {args.import_budget * 1e3:.2f} ms budget", file=sys.stderr)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for result, baseline_time in regressions:
+            print(f"REGRESSION {result['id']}: {result['time'] * 1e3:.2f} ms vs {baseline_time * 1e3:.2f} ms in baseline", file=sys.stderr)
+    return 1 if regressions or over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import os
+import asyncio
+import functools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from galmask.batch import galmask_one, open_pool
+from galmask.galmask import GalMasker, galmask
+
+
+async def galmask_async(image, *args, executor=None, timeout=None, **kwargs):
+    """Run `galmask` without blocking the event loop.
+
+    For repeated calls, e.g. in a service, use an `AsyncGalMasker` instead: it shares the masker state and bounds the
+    no. of concurrent calls.
+
+    :param image: Galaxy image.
+    :type image: numpy.ndarray
+    :param args: Positional arguments of `galmask`.
+    :param executor: Executor running the call, defaults to None (the default executor of the event loop).
+    :type executor: concurrent.futures.Executor, optional
+    :param timeout: Maximum time in seconds to wait for the result, defaults to None (no timeout).
+    :type timeout: float, optional
+    :param kwargs: Keyword arguments of `galmask`.
+
+    :return galmasked: Galaxy image with the background source detections removed.
+    :rtype: numpy.ndarray
+    :return x: Galaxy mask.
+    :rtype: numpy.ndarray
+
+    """
+    loop = asyncio.get_running_loop()
+    return await asyncio.wait_for(loop.run_in_executor(executor, functools.partial(galmask, image, *args, **kwargs)), timeout)
+
+
+class AsyncGalMasker:
+    """Asyncio interface to a `GalMasker`, running the calls in a bounded pool of workers.
+
+    At most `max_pending` images are submitted to the pool at any time: further calls wait for a free slot, which
+    applies backpressure to the callers instead of queueing unbounded work. Awaiting calls can be cancelled or time
+    out. Images not yet started by a worker are then dropped from the pool, while an image already being processed
+    runs to completion (Python cannot interrupt it) and keeps its slot until then.
+
+    The masker parameters are the same as those of `galmask`.
+
+    :param executor: Either "process", "thread" or an existing `concurrent.futures.Executor`, defaults to "process".
+    :type executor: str or concurrent.futures.Executor, optional
+    :param n_jobs: No. of workers of the pool, if created here, defaults to the no. of CPUs.
+    :type n_jobs: int, optional
+    :param max_pending: Maximum no. of images submitted to the pool and not yet processed, defaults to `2 * n_jobs` or to 2 times the no. of CPUs.
+    :type max_pending: int, optional
+
+    """
+    def __init__(self, *args, executor="process", n_jobs=None, max_pending=None, **kwargs):
+        self.masker = GalMasker(*args, **kwargs)
+        n_jobs = n_jobs or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * n_jobs
+        self._pool, self._task_masker, self._own_executor = open_pool(executor, n_jobs, self.masker)
+        self._pop_profile = isinstance(self._pool, ProcessPoolExecutor) and self.masker.profiler is not None
+        self._semaphore = None  # Created in the event loop, see `_slot`.
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    def close(self, wait=True):
+        """Shut down the pool if it was created by this instance."""
+        if self._own_executor:
+            self._pool.shutdown(wait=wait)
+
+    def _slot(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        return self._semaphore
+
+    async def __call__(self, image, seg_image=None, timeout=None):
+        """Mask an image without blocking the event loop, see `galmask`.
+
+        :param image: Galaxy image.
+        :type image: numpy.ndarray
+        :param seg_image: Segmentation map.
+        :type seg_image: numpy.ndarray, optional
+        :param timeout: Maximum time in seconds to wait for the result, including the time spent waiting for a free slot, defaults to None (no timeout).
+        :type timeout: float, optional
+
+        :return galmasked: Galaxy image with the background source detections removed.
+        :rtype: numpy.ndarray
+        :return x: Galaxy mask.
+        :rtype: numpy.ndarray
+
+        """
+        return await asyncio.wait_for(self._run(image, seg_image), timeout)
+
+    async def _run(self, image, seg_image):
+        loop = asyncio.get_running_loop()
+        semaphore = self._slot()
+        await semaphore.acquire()
+        try:
+            future = self._pool.submit(galmask_one, self._task_masker, image, seg_image, None, pop_profile=self._pop_profile)
+        except BaseException:
+            semaphore.release()
+            raise
+        # The slot is released when the worker is done with the image, not when the caller stops waiting for it.
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(semaphore.release))
+        result, error, records = await asyncio.wrap_future(future)
+        if records:
+            self.masker.profiler.merge(records)
+        if error is not None:
+            raise error
+        return result
+
+    async def imap(self, images, seg_images=None, timeout=None):
+        """Mask a sequence of images concurrently, yielding the results in input order.
+
+        Images are read from `images` only as slots become free, so lazy and infinite inputs are supported.
+
+        :param images: Galaxy images.
+        :type images: iterable or async iterable of numpy.ndarray
+        :param seg_images: Segmentation maps, one per image (entries may be None).
+        :type seg_images: iterable of numpy.ndarray, optional
+        :param timeout: Maximum time in seconds to wait for each result, defaults to None (no timeout).
+        :type timeout: float, optional
+
+        :return: Async generator of `(result, error)` tuples, as `galmask.batch.galmask_imap`. A timed out image gets an `asyncio.TimeoutError`.
+        :rtype: async generator
+
+        """
+        async def run(image, seg_image):
+            try:
+                return await self(image, seg_image=seg_image, timeout=timeout), None
+            except Exception as exc:
+                return None, exc
+
+        seg_iter = repeat(None) if seg_images is None else iter(seg_images)
+        pending = deque()
+        try:
+            async for image in _aiter(images):
+                try:
+                    seg_image = next(seg_iter)
+                except StopIteration:
+                    raise ValueError("`seg_images` must have one entry per image.") from None
+                pending.append(asyncio.ensure_future(run(image, seg_image)))
+                if len(pending) >= self.max_pending:
+                    yield await pending.popleft()
+            while pending:
+                yield await pending.popleft()
+        finally:
+            for task in pending:  # Only non-empty if the consumer stopped early or was cancelled.
+                task.cancel()
+
+
+async def _aiter(iterable):
+    if hasattr(iterable, "__aiter__"):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
@@ -0,0 +1,79 @@
+def estimate_background(image, box_size=None, filter_size=3, sigma=3.0, maxiters=10):
+    """Estimate the background level and background RMS of an image.
+
+    Without `box_size`, a single sigma-clipping pass over the image gives both the global background (clipped median)
+    and RMS (clipped standard deviation). These are the values galmask used to get from two separate passes,
+    `photutils.background.MedianBackground` and `photutils.segmentation.detect_threshold`.
+
+    With `box_size`, spatially varying background and RMS maps are estimated on a grid of boxes with
+    `photutils.background.Background2D`. The returned values can be computed once and passed to `galmask`, e.g. for
+    several cutouts of the same field.
+
+    :param image: Galaxy image.
+    :type image: numpy.ndarray
+    :param box_size: Size of the boxes used to estimate a background map, defaults to None (global background).
+    :type box_size: int or tuple, optional
+    :param filter_size: Size of the median filter applied to the background map, only used with `box_size`, defaults to 3.
+    :type filter_size: int or tuple, optional
+    :param sigma: No. of standard deviations used for sigma clipping, defaults to 3.0.
+    :type sigma: float, optional
+    :param maxiters: Maximum no. of sigma-clipping iterations, defaults to 10.
+    :type maxiters: int, optional
+
+    :return background: Background level, a float or an array of the same shape as the image.
+    :rtype: float or numpy.ndarray
+    :return background_rms: Background RMS, a float or an array of the same shape as the image.
+    :rtype: float or numpy.ndarray
+
+    """
+    from astropy.stats import sigma_clipped_stats
+
+    if box_size is None:
+        _, median, std = sigma_clipped_stats(image, sigma=sigma, maxiters=maxiters)
+        return median, std
+
+    from astropy.stats import SigmaClip
+    from photutils.background import Background2D, MedianBackground
+
+    bkg = Background2D(
+        image, box_size, filter_size=filter_size, sigma_clip=SigmaClip(sigma=sigma, maxiters=maxiters),
+        bkg_estimator=MedianBackground()
+    )
+    return bkg.background, bkg.background_rms
+
+def estimate_background_rms(image_bkg_subtracted, sigma=3.0, maxiters=10):
+    """Estimate the global background RMS of a background-subtracted image, see `estimate_background`.
+
+    :param image_bkg_subtracted: Background-subtracted image.
+    :type image_bkg_subtracted: numpy.ndarray
+
+    :return background_rms: Background RMS.
+    :rtype: float
+
+    """
+    from astropy.stats import sigma_clipped_stats
+
+    return sigma_clipped_stats(image_bkg_subtracted, sigma=sigma, maxiters=maxiters)[2]
+
+def estimate_background_stack(images, sigma=3.0, maxiters=10):
+    """Estimate the global background level and RMS of each image of a stack in a single vectorized pass.
+
+    Gives the same values as calling `estimate_background` without `box_size` on each image.
+
+    :param images: Stack of images of shape (N, H, W).
+    :type images: numpy.ndarray
+    :param sigma: No. of standard deviations used for sigma clipping, defaults to 3.0.
+    :type sigma: float, optional
+    :param maxiters: Maximum no. of sigma-clipping iterations, defaults to 10.
+    :type maxiters: int, optional
+
+    :return background: Background level of each image, of shape (N,).
+    :rtype: numpy.ndarray
+    :return background_rms: Background RMS of each image, of shape (N,).
+    :rtype: numpy.ndarray
+
+    """
+    from astropy.stats import sigma_clipped_stats
+
+    _, median, std = sigma_clipped_stats(images, sigma=sigma, maxiters=maxiters, axis=(1, 2))
+    return median, std
@@ -0,0 +1,259 @@
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+from galmask.galmask import GalMasker
+
+
+_worker_masker = None  # Masker shared by all the images processed in a worker, set by `_init_worker`.
+
+
+def _init_worker(masker):
+    global _worker_masker
+    _worker_masker = masker
+
+def worker_masker(masker=None):
+    """Return `masker`, or if None, the masker shared by the tasks of the current worker process.
+
+    The shared masker is set when the worker starts, for the pools created by `make_executor`. Sending None instead
+    of the masker with each task avoids pickling the masker (and its kernel) for every task.
+
+    :param masker: Masker sent with the task, if any.
+    :type masker: galmask.galmask.GalMasker, optional
+
+    :return masker: Masker to use for the task.
+    :rtype: galmask.galmask.GalMasker
+
+    """
+    return _worker_masker if masker is None else masker
+
+def galmask_one(masker, image, seg_image, params, pop_profile=False):
+    """Run galmask on a single image, returning the exception instead of raising it.
+
+    The image is processed by a masker built from `params` if they are given, else by `masker` or, if None, by the
+    worker's shared masker, see `worker_masker`.
+
+    :param masker: Masker, or None to use the worker's shared masker.
+    :type masker: galmask.galmask.GalMasker
+    :param image: Galaxy image.
+    :type image: numpy.ndarray
+    :param seg_image: Segmentation map, or None.
+    :type seg_image: numpy.ndarray
+    :param params: Keyword arguments of `galmask` for this image, or None.
+    :type params: dict
+    :param pop_profile: Whether to also return the records of the masker's profiler, so that they can be sent back from a worker process, defaults to False.
+    :type pop_profile: bool, optional
+
+    :return result: The `(galmasked, mask)` tuple, or None if galmask failed.
+    :rtype: tuple
+    :return error: The raised exception, or None on success.
+    :rtype: Exception
+    :return records: Profiler records, see `galmask.profiling.StageProfiler.pop_records`, or None.
+    :rtype: dict
+
+    """
+    if params is None:
+        masker = worker_masker(masker)
+    profiler = (params or {}).get("profiler", None if masker is None else masker.profiler)
+    try:
+        if params is not None:
+            masker = GalMasker(**params)
+        result, error = masker(image, seg_image=seg_image), None
+    except Exception as exc:  # A failure for one image (e.g. no source detected) must not abort the whole batch.
+        result, error = None, exc
+    records = profiler.pop_records() if pop_profile and profiler is not None else None
+    return result, error, records
+
+def _iter_tasks(images, seg_images, params, kwargs):
+    if isinstance(images, np.ndarray) and images.ndim != 3:
+        raise ValueError("A stack of images must be a 3D array of shape (N, H, W).")
+
+    seg_iter = repeat(None) if seg_images is None else iter(seg_images)
+    param_iter = repeat(None) if params is None else iter(params)
+    for image in images:
+        try:
+            seg_image = next(seg_iter)
+            image_params = next(param_iter)
+        except StopIteration:
+            raise ValueError("`seg_images` and `params` must have one entry per image.") from None
+        yield image, seg_image, None if image_params is None else {**kwargs, **image_params}
+
+def make_executor(executor, n_jobs, masker):
+    """Create a pool of `n_jobs` workers sharing `masker`, see `worker_masker`.
+
+    Each process of a process pool holds its own copy of the masker, sent once when it starts. Threads share a
+    single global masker, so the tasks of thread pools should be sent the masker itself, in case several pools run
+    at the same time.
+
+    :param executor: Either "process" or "thread".
+    :type executor: str
+    :param n_jobs: No. of workers.
+    :type n_jobs: int
+    :param masker: Masker shared by the workers, or None.
+    :type masker: galmask.galmask.GalMasker
+
+    :return pool: The new pool, to be shut down by the caller.
+    :rtype: concurrent.futures.Executor
+
+    """
+    if executor == "process":
+        return ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(masker,))
+    elif executor == "thread":
+        return ThreadPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(masker,))
+    raise ValueError(f"Unknown executor {executor!r}, must be one of 'process', 'thread' or a concurrent.futures.Executor.")
+
+def open_pool(executor, n_jobs, masker):
+    """Get a pool of workers for `masker`, creating it with `make_executor` if `executor` is a string.
+
+    Processes of a pool created here hold a copy of the masker, set by the pool initializer, so their tasks are sent
+    None instead, see `worker_masker`. Threads, which share the worker masker with any other pool of the process,
+    and the workers of an existing executor are sent the masker itself.
+
+    :param executor: Either "process", "thread" or an existing `concurrent.futures.Executor`.
+    :type executor: str or concurrent.futures.Executor
+    :param n_jobs: No. of workers of the pool, if created here.
+    :type n_jobs: int
+    :param masker: Masker used by the tasks, or None.
+    :type masker: galmask.galmask.GalMasker
+
+    :return pool: The pool.
+    :rtype: concurrent.futures.Executor
+    :return task_masker: Masker to send with each task.
+    :rtype: galmask.galmask.GalMasker or None
+    :return own_executor: Whether the pool was created here, and so must be shut down by the caller.
+    :rtype: bool
+
+    """
+    own_executor = not isinstance(executor, Executor)
+    pool = make_executor(executor, n_jobs, masker) if own_executor else executor
+    task_masker = None if own_executor and isinstance(pool, ProcessPoolExecutor) else masker
+    return pool, task_masker, own_executor
+
+def imap_bounded(fn, tasks, masker, n_jobs, executor="process", max_pending=None):
+    """Run `fn(masker, *args)` for each `(key, args)` of `tasks` in a pool of workers, yielding the results in order.
+
+    At most `max_pending` tasks are submitted and not yet yielded at any time, so `tasks` is only read as the results
+    are consumed and memory use does not grow with the no. of tasks. Tasks still pending when the consumer stops
+    early or an exception is raised are cancelled, and a pool created here (see `open_pool`) is shut down.
+
+    :param fn: Function run by the workers, whose first argument is the masker, see `worker_masker`.
+    :type fn: callable
+    :param tasks: `(key, args)` pairs, where `key` is passed through to the results.
+    :type tasks: iterable of tuple
+    :param masker: Masker used by the tasks, or None.
+    :type masker: galmask.galmask.GalMasker
+    :param n_jobs: No. of workers of the pool, if created here.
+    :type n_jobs: int
+    :param executor: Either "process", "thread" or an existing `concurrent.futures.Executor`, defaults to "process".
+    :type executor: str or concurrent.futures.Executor, optional
+    :param max_pending: Maximum no. of tasks submitted but not yet yielded, defaults to `4 * n_jobs`.
+    :type max_pending: int, optional
+
+    :return: Generator of `(key, result)` tuples in input order, `result` being the return value of `fn`.
+    :rtype: generator
+
+    """
+    max_pending = max_pending or 4 * n_jobs
+    pool, task_masker, own_executor = open_pool(executor, n_jobs, masker)
+    pending = deque()
+    try:
+        for key, args in tasks:
+            pending.append((key, pool.submit(fn, task_masker, *args)))
+            if len(pending) >= max_pending:
+                key, future = pending.popleft()
+                yield key, future.result()
+        while pending:
+            key, future = pending.popleft()
+            yield key, future.result()
+    finally:
+        for _, future in pending:  # Only non-empty if the consumer stopped early or an exception was raised.
+            future.cancel()
+        if own_executor:
+            pool.shutdown(wait=True)
+
+def galmask_imap(images, seg_images=None, params=None, n_jobs=None, executor="process", max_pending=None, **kwargs):
+    """Lazily run galmask over a sequence of images, yielding results in input order.
+
+    :param images: Galaxy images: a list, an iterator or a 3D array of shape (N, H, W). A 3D array (e.g. memory-mapped) processed serially without `params` or a `cache` goes through the vectorized stack engine, which reads it chunk by chunk, see `galmask.galmask.GalMasker.iter_stack`.
+    :type images: iterable of numpy.ndarray
+    :param seg_images: Segmentation maps, one per image (entries may be None).
+    :type seg_images: iterable of numpy.ndarray, optional
+    :param params: Per-image keyword arguments for `galmask`, overriding the shared ones given in `kwargs`.
+    :type params: iterable of dict, optional
+    :param n_jobs: No. of workers. If 1 and `executor` is a string, images are processed serially in the calling process, defaults to the no. of CPUs.
+    :type n_jobs: int, optional
+    :param executor: Either "process", "thread" or an existing `concurrent.futures.Executor`, defaults to "process".
+    :type executor: str or concurrent.futures.Executor, optional
+    :param max_pending: Maximum no. of images submitted but not yet yielded. Bounds memory usage for large or lazy inputs, defaults to `4 * n_jobs`.
+    :type max_pending: int, optional
+    :param kwargs: Keyword arguments shared by all images, passed to `galmask` (e.g. `npixels`, `nlevels`, `mode`). A `profiler` aggregates the stage timings of all images, including those processed in worker processes.
+
+    :return: Generator of `(result, error)` tuples. `result` is the `(galmasked, mask)` tuple returned by `galmask` and `error` is None on success, else `result` is None and `error` is the raised exception.
+    :rtype: generator
+
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    tasks = _iter_tasks(images, seg_images, params, kwargs)
+    # Without per-image parameters, a single masker is built and shared by all the images of a worker.
+    masker = GalMasker(**kwargs) if params is None else None
+
+    if n_jobs == 1 and isinstance(executor, str):
+        if isinstance(images, np.ndarray) and images.ndim == 3 and masker is not None and masker.cache is None:
+            # Equal-size images: the image-wise steps are vectorized over the whole stack, see `GalMasker.iter_stack`.
+            # Results are only cached per image, so a cached masker takes the per-image path below.
+            for image, (x, error) in zip(images, masker.iter_stack(images, seg_images=seg_images)):
+                if error is not None:
+                    yield None, error
+                    continue
+                with masker.stage("apply"):
+                    galmasked = np.multiply(x, image)
+                yield (galmasked, x), None
+            return
+        for task in tasks:
+            yield galmask_one(masker, *task)[:2]
+        return
+
+    # Worker processes profile into their own copy of the profiler, whose records are sent back and merged here.
+    profiler = kwargs.get("profiler")
+    pop_profile = profiler is not None and (executor == "process" or isinstance(executor, ProcessPoolExecutor))
+    calls = ((None, (*task, pop_profile)) for task in tasks)
+    for _, (result, error, records) in imap_bounded(galmask_one, calls, masker, n_jobs, executor, max_pending):
+        if records:
+            profiler.merge(records)
+        yield result, error
+
+def galmask_batch(images, seg_images=None, params=None, n_jobs=None, executor="process", **kwargs):
+    """Run galmask over a batch of images in parallel.
+
+    Failures are reported per image: an image for which `galmask` raises (e.g. when no source is detected) gets
+    a `None` result and its exception is stored in `failures`, the rest of the batch is processed as usual.
+
+    :param images: Galaxy images: a list, an iterator or a 3D array of shape (N, H, W).
+    :type images: iterable of numpy.ndarray
+    :param seg_images: Segmentation maps, one per image (entries may be None).
+    :type seg_images: iterable of numpy.ndarray, optional
+    :param params: Per-image keyword arguments for `galmask`, overriding the shared ones given in `kwargs`.
+    :type params: iterable of dict, optional
+    :param n_jobs: No. of workers, defaults to the no. of CPUs.
+    :type n_jobs: int, optional
+    :param executor: Either "process", "thread" or an existing `concurrent.futures.Executor`, defaults to "process".
+    :type executor: str or concurrent.futures.Executor, optional
+    :param kwargs: Keyword arguments shared by all images, passed to `galmask`.
+
+    :return results: `(galmasked, mask)` tuples in input order, None for failed images.
+    :rtype: list
+    :return failures: Mapping from the index of each failed image to the raised exception.
+    :rtype: dict
+
+    """
+    results, failures = [], {}
+    for index, (result, error) in enumerate(
+        galmask_imap(images, seg_images=seg_images, params=params, n_jobs=n_jobs, executor=executor, **kwargs)
+    ):
+        results.append(result)
+        if error is not None:
+            failures[index] = error
+    return results, failures
@@ -0,0 +1,172 @@
+import os
+import glob
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Fraction of `max_bytes` to which the disk tier is shrunk once full, so that it is not listed again on the next writes.
+EVICTION_TARGET = 0.9
+
+def cache_key(*arrays, **params):
+    """Content hash of arrays and parameters, used as the key of cached galmask results.
+
+    Arrays are hashed by dtype, shape and bytes, so equal images give the same key whatever their memory layout.
+
+    :param arrays: Arrays (e.g. image, segmentation map, kernel), None or scalar values.
+    :param params: Parameters, whose values must be None, scalars, strings, tuples or arrays.
+
+    :return key: Hexadecimal SHA-256 digest.
+    :rtype: str
+
+    """
+    digest = hashlib.sha256()
+
+    def update(value):
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, np.ndarray):
+            value = np.ascontiguousarray(value)
+            digest.update(f"ndarray:{value.dtype.str}:{value.shape}:".encode())
+            digest.update(value.data)
+        else:
+            digest.update(f"{type(value).__name__}:{json.dumps(value, default=repr)};".encode())
+
+    for array in arrays:
+        update(array)
+    for name in sorted(params):
+        digest.update(f"{name}=".encode())
+        update(params[name])
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Cache of `(galmasked, mask)` results, with an in-memory LRU tier and an optional on-disk tier.
+
+    Results are looked up in memory first, then on disk, where they are stored as compressed `.npz` files named after
+    their key. When the disk tier exceeds `max_bytes`, the least recently used files are removed until it is below
+    `EVICTION_TARGET` times `max_bytes`, always keeping the result just stored. The disk tier can be
+    shared by several processes, e.g. the workers of `galmask.batch.galmask_batch`, while each process has its own
+    memory tier. Each process keeps a running total of the size of the disk tier and only lists its files when the
+    total exceeds `max_bytes`, so files written by other processes are only accounted for then, and the disk tier may
+    temporarily exceed `max_bytes` when shared. Instances are thread-safe.
+
+    Pass an instance as the `cache` argument of `galmask` or `GalMasker`.
+
+    :param maxsize: Maximum no. of results kept in memory, defaults to 128. Use 0 to only cache on disk.
+    :type maxsize: int, optional
+    :param directory: Directory of the disk tier, created if needed, defaults to None (no disk tier).
+    :type directory: str, optional
+    :param max_bytes: Maximum total size in bytes of the disk tier, defaults to None (unbounded).
+    :type max_bytes: int, optional
+
+    """
+    def __init__(self, maxsize=128, directory=None, max_bytes=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self._memory = OrderedDict()
+        self._disk_bytes = None  # Size of the disk tier when last listed plus the size written since, None if unknown.
+        self._lock = threading.Lock()
+
+    def __getstate__(self):  # The memory tier and the size of the disk tier are not copied to worker processes.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_memory"] = OrderedDict()
+        state["_disk_bytes"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        """Return copies of the result stored under `key`, or None if there is none."""
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+        if result is None and self.directory is not None:
+            try:
+                with np.load(self._path(key)) as npz:
+                    result = npz["galmasked"], npz["mask"]
+                os.utime(self._path(key))  # Mark as recently used for eviction.
+            except (OSError, KeyError, ValueError):  # Missing, evicted or partially written.
+                return None
+            self._remember(key, result)
+        return None if result is None else (result[0].copy(), result[1].copy())
+
+    def put(self, key, result):
+        """Store a copy of the `(galmasked, mask)` result under `key`."""
+        galmasked, mask = (np.array(array) for array in result)
+        self._remember(key, (galmasked, mask))
+        if self.directory is None:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, galmasked=galmasked, mask=mask)
+            size = os.path.getsize(tmp)
+            os.replace(tmp, self._path(key))  # Atomic, so that concurrent readers never see a partial file.
+        except BaseException:
+            os.remove(tmp)
+            raise
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            if self._disk_bytes is not None and self._disk_bytes + size <= self.max_bytes:
+                self._disk_bytes += size
+                return
+        self._evict(keep=self._path(key))
+
+    def _remember(self, key, result):
+        if self.maxsize <= 0:
+            return
+        for array in result:
+            array.flags.writeable = False
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.maxsize:
+                self._memory.popitem(last=False)
+
+    def _evict(self, keep=None):
+        """List the files of the disk tier and, if it exceeds `max_bytes`, remove the least recently used ones but `keep`."""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*.npz")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # Removed by another process.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= EVICTION_TARGET * self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        with self._lock:
+            self._disk_bytes = total
+
+    def clear(self):
+        """Remove all the cached results, in memory and on disk."""
+        with self._lock:
+            self._memory.clear()
+            self._disk_bytes = None
+        if self.directory is not None:
+            for path in glob.glob(os.path.join(self.directory, "*.npz")):
+                os.remove(path)
@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+
+from galmask.batch import imap_bounded, worker_masker
+from galmask.galmask import GalMasker
+
+DEFAULT_CHUNK_SIZE = 256
+
+
+def open_array(path, mode="r", shape=None, chunks=None, dtype=bool):
+    """Open an on-disk array of images, either a ".npy" file (memory-mapped) or a zarr array (requires `zarr`).
+
+    :param path: Path of a ".npy" file or of a zarr array (any other path, e.g. "masks.zarr").
+    :type path: str
+    :param mode: "r" to read an existing array, "w" to create (or overwrite) one, "w-" to create one that must not exist, defaults to "r".
+    :type mode: str, optional
+    :param shape: Shape of the array to create.
+    :type shape: tuple, optional
+    :param chunks: Chunk shape of the zarr array to create, defaults to zarr's choice. Ignored for ".npy" files.
+    :type chunks: tuple, optional
+    :param dtype: Data type of the array to create, defaults to bool.
+    :type dtype: data-type, optional
+
+    :return array: Array supporting slicing, read-only if `mode` is "r".
+    :rtype: numpy.memmap or zarr.Array
+
+    """
+    if mode not in ("r", "w", "w-"):
+        raise ValueError(f"Invalid mode {mode!r}, must be one of 'r', 'w' or 'w-'.")
+    if path.lower().endswith(".npy"):
+        if mode == "r":
+            return np.load(path, mmap_mode="r")
+        if mode == "w-" and os.path.exists(path):
+            raise FileExistsError(f"File {path!r} already exists.")
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+    try:
+        import zarr
+    except ImportError:
+        raise ImportError("Reading and writing zarr arrays requires `zarr`, install it with `pip install zarr`.") from None
+    if mode == "r":
+        return zarr.open_array(path, mode="r")
+    return zarr.open_array(path, mode=mode, shape=shape, chunks=chunks, dtype=dtype)
+
+def _chunk_size(images):
+    chunks = getattr(images, "chunks", None)  # zarr arrays give a tuple of ints, dask arrays a tuple of tuples.
+    if not chunks:
+        return DEFAULT_CHUNK_SIZE
+    return int(np.max(chunks[0]))
+
+def _flush(output):
+    if isinstance(output, np.memmap):
+        output.flush()
+    return output
+
+def _mask_chunk(masker, images, seg_images):
+    """Compute the boolean masks of a chunk of images, returning the exception of each failed image instead of raising it."""
+    masker = worker_masker(masker)
+    masks = np.zeros(images.shape, dtype=bool)
+    errors = {}
+    for i, (x, error) in enumerate(masker.iter_stack(images, seg_images=seg_images)):
+        if error is None:
+            masks[i] = x
+        else:
+            errors[i] = error
+    return masks, errors
+
+def galmask_chunked(
+    images, output, seg_images=None, chunk_size=None, n_jobs=None, executor="process", max_pending=None,
+    overwrite=False, **kwargs
+):
+    """Compute the galaxy masks of a stack of images larger than memory, chunk by chunk.
+
+    `images` can be any array-like of shape (N, H, W) supporting slicing along its first axis, e.g. a memory-mapped
+    ".npy" file, a zarr or h5py array or a dask array. Chunks of `chunk_size` images are read one at a time, masked
+    by a pool of workers with the vectorized stack engine (see `galmask.galmask.GalMasker.iter_stack`) and their masks
+    are written to `output` as soon as they are ready, in input order. At most `max_pending` chunks are in flight at
+    any time, so memory use depends on the chunk size and the no. of workers, not on the no. of images.
+
+    The mask of an image that could not be masked (e.g. no source detected) is left empty (all False) and its
+    exception is reported in `failures`.
+
+    :param images: Stack of galaxy images, or the path of one, see `open_array`.
+    :type images: array-like or str
+    :param output: Array of shape (N, H, W) in which the masks are written, or the path of an array created with a boolean dtype and `chunk_size` images per chunk, see `open_array`.
+    :type output: array-like or str
+    :param seg_images: Segmentation maps, one per image, as an array-like of the shape of `images` or its path, defaults to None.
+    :type seg_images: array-like or str, optional
+    :param chunk_size: No. of images per chunk, defaults to the chunk size of `images` along its first axis if it is chunked, else to `DEFAULT_CHUNK_SIZE`.
+    :type chunk_size: int, optional
+    :param n_jobs: No. of workers. If 1 and `executor` is a string, chunks are processed serially in the calling process, defaults to the no. of CPUs.
+    :type n_jobs: int, optional
+    :param executor: Either "process", "thread" or an existing `concurrent.futures.Executor`, defaults to "process".
+    :type executor: str or concurrent.futures.Executor, optional
+    :param max_pending: Maximum no. of chunks read but not yet written, defaults to `2 * n_jobs`.
+    :type max_pending: int, optional
+    :param overwrite: Whether to overwrite an existing output given as a path, defaults to False.
+    :type overwrite: bool, optional
+    :param kwargs: Keyword arguments of `galmask` (e.g. `npixels`, `nlevels`, `mode`).
+
+    :return output: Galaxy masks, `output` itself if it is an array.
+    :rtype: array-like
+    :return failures: Mapping from the index of each image that could not be masked to the raised exception.
+    :rtype: dict
+
+    """
+    if isinstance(images, str):
+        images = open_array(images)
+    if isinstance(seg_images, str):
+        seg_images = open_array(seg_images)
+    if len(images.shape) != 3:
+        raise ValueError("A stack of images must be a 3D array of shape (N, H, W).")
+    if seg_images is not None and tuple(seg_images.shape) != tuple(images.shape):
+        raise ValueError("`seg_images` must have the shape of `images`.")
+    chunk_size = chunk_size or _chunk_size(images)
+    if isinstance(output, str):
+        output = open_array(
+            output, mode="w" if overwrite else "w-", shape=tuple(images.shape), chunks=(chunk_size, *images.shape[1:])
+        )
+    elif tuple(output.shape) != tuple(images.shape):
+        raise ValueError("`output` must have the shape of `images`.")
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    max_pending = max_pending or 2 * n_jobs
+    masker = GalMasker(**kwargs)
+    failures = {}
+
+    def read(start):
+        stop = min(start + chunk_size, images.shape[0])
+        return np.asarray(images[start:stop]), None if seg_images is None else np.asarray(seg_images[start:stop])
+
+    def write(start, result):
+        masks, errors = result
+        output[start:start + len(masks)] = masks
+        failures.update((start + i, error) for i, error in errors.items())
+
+    starts = range(0, images.shape[0], chunk_size)
+    if n_jobs == 1 and isinstance(executor, str):
+        for start in starts:
+            write(start, _mask_chunk(masker, *read(start)))
+        return _flush(output), failures
+
+    tasks = ((start, read(start)) for start in starts)
+    for start, result in imap_bounded(_mask_chunk, tasks, masker, n_jobs, executor, max_pending):
+        write(start, result)
+    return _flush(output), failures
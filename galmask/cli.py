@@ -0,0 +1,172 @@
+import os
+import sys
+import glob
+import json
+import argparse
+
+from galmask.io import stream_galmask
+
+REQUIRED_PARAMS = ("npixels", "nlevels", "nsigma", "contrast", "min_distance", "num_peaks", "num_peaks_per_label")
+
+
+def load_params(filename=None, overrides=()):
+    """Load galmask keyword arguments from a JSON parameter file and `KEY=VALUE` overrides.
+
+    Values of the overrides are parsed as JSON if possible, else kept as strings. If the `kernel` parameter is a
+    string, it is read as a FITS file.
+
+    :param filename: JSON file containing an object mapping galmask parameter names to values, defaults to None.
+    :type filename: str, optional
+    :param overrides: `KEY=VALUE` strings taking precedence over the parameter file, defaults to ().
+    :type overrides: iterable of str, optional
+
+    :return params: Keyword arguments for galmask.
+    :rtype: dict
+
+    """
+    params = {}
+    if filename is not None:
+        with open(filename) as f:
+            params.update(json.load(f))
+    for override in overrides:
+        key, sep, value = override.partition("=")
+        if not sep:
+            raise ValueError(f"Parameter override {override!r} is not of the form KEY=VALUE.")
+        try:
+            params[key] = json.loads(value)
+        except json.JSONDecodeError:
+            params[key] = value
+
+    missing = [name for name in REQUIRED_PARAMS if name not in params]
+    if missing:
+        raise ValueError(f"Missing galmask parameters: {', '.join(missing)}.")
+    if "mode" in params:  # Modes are strings, but "mode=1" parses as an integer.
+        params["mode"] = str(params["mode"])
+    if isinstance(params.get("kernel"), str):
+        from astropy.io import fits
+
+        params["kernel"] = fits.getdata(params["kernel"])
+    return params
+
+def expand_inputs(patterns):
+    """Expand glob patterns into a sorted, duplicate-free list of files, keeping the order of the patterns."""
+    filenames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or ([pattern] if os.path.isfile(pattern) else [])
+        if not matches:
+            raise FileNotFoundError(f"No input file matches {pattern!r}.")
+        filenames.extend(matches)
+    return list(dict.fromkeys(os.path.abspath(filename) for filename in filenames))
+
+def check_output_names(filenames):
+    """Raise a `ValueError` if several inputs would be written to the same `<name>_galmask.fits` output.
+
+    Outputs are named after the base name of their input, so e.g. "a/gal.fits" and "b/gal.fits" collide.
+    """
+    inputs = {}
+    for filename in filenames:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        if name in inputs:
+            raise ValueError(
+                f"Inputs {inputs[name]!r} and {filename!r} would both be written to {name}_galmask.fits, "
+                "rename one of them or run them with different outputs."
+            )
+        inputs[name] = filename
+
+def read_manifest(filename, retry_failed=False):
+    """Read the set of inputs already processed from a manifest written by a previous run.
+
+    :param filename: Manifest file, one JSON record per line.
+    :type filename: str
+    :param retry_failed: Whether inputs for which galmask failed should be processed again, defaults to False.
+    :type retry_failed: bool, optional
+
+    :return done: Absolute paths of the inputs to skip.
+    :rtype: set
+
+    """
+    done = set()
+    if not os.path.exists(filename):
+        return done
+    with open(filename) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:  # Last line may be truncated if the previous run was killed.
+                continue
+            if record["status"] == "ok" or not retry_failed:
+                done.add(record["input"])
+    return done
+
+def _ends_with_newline(filename):
+    with open(filename, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def _extension(value):
+    """FITS extension given either by index or by name."""
+    return int(value) if value.isdigit() else value
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="galmask", fromfile_prefix_chars="@",
+        description="Remove background source detections from galaxy images stored in FITS files. "
+                    "Arguments can be read from a file, one per line, by passing @filename."
+    )
+    parser.add_argument("inputs", nargs="+", help="Input FITS files or glob patterns.")
+    parser.add_argument("-o", "--output", required=True, help="Output directory, receives one <name>_galmask.fits file per input, so input names must be unique.")
+    parser.add_argument("-p", "--params", help="JSON file with galmask parameters (npixels, nlevels, nsigma, contrast, mode, ...).")
+    parser.add_argument("-s", "--set", dest="overrides", action="append", default=[], metavar="KEY=VALUE",
+                        help="Set a galmask parameter, overriding the parameter file. Can be repeated.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="No. of parallel workers (default: 1).")
+    parser.add_argument("--executor", choices=("process", "thread"), default="process", help="Kind of workers (default: process).")
+    parser.add_argument("--ext", type=_extension, default=0, help="Extension holding the image (default: 0).")
+    parser.add_argument("--seg-ext", type=_extension, default=None, help="Extension holding a precomputed segmentation map (default: none).")
+    parser.add_argument("--manifest", help="Manifest of processed inputs used to resume interrupted runs (default: OUTPUT/manifest.jsonl).")
+    parser.add_argument("--retry-failed", action="store_true", help="Process again the inputs that failed in a previous run.")
+    return parser
+
+def parse_args(argv=None):
+    return make_parser().parse_args(argv)
+
+def main(argv=None):
+    """Entry point of the `galmask` command."""
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    try:
+        params = load_params(args.params, args.overrides)
+        filenames = expand_inputs(args.inputs)
+        check_output_names(filenames)
+    except (ValueError, OSError) as exc:  # User mistakes, reported like the other argument errors (exit status 2).
+        parser.error(str(exc))
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest = args.manifest or os.path.join(args.output, "manifest.jsonl")
+    done = read_manifest(manifest, retry_failed=args.retry_failed)
+    todo = [filename for filename in filenames if filename not in done]
+    print(f"galmask: {len(filenames) - len(todo)} of {len(filenames)} inputs already processed.", file=sys.stderr)
+
+    n_failed = 0
+    results = stream_galmask(
+        todo, output=args.output, ext=args.ext, seg_ext=args.seg_ext, n_jobs=args.jobs, executor=args.executor,
+        overwrite=True, **params
+    )
+    with open(manifest, "a") as f:
+        if f.tell() and not _ends_with_newline(manifest):  # Terminate a record truncated by a killed run.
+            f.write("\n")
+        # The outputs of an input are written before its manifest record, so a run killed in between redoes it.
+        for filename, (_, _, error) in zip(todo, results):
+            record = {"input": filename, "status": "ok"}
+            if error is not None:
+                n_failed += 1
+                record.update(status="failed", error=f"{type(error).__name__}: {error}")
+                print(f"galmask: {filename}: {record['error']}", file=sys.stderr)
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+
+    print(f"galmask: processed {len(todo)} inputs, {n_failed} failed.", file=sys.stderr)
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,25 @@
-import cv2
 import numpy as np
 import warnings
+from contextlib import nullcontext
+from functools import lru_cache
 
-from skimage.feature import peak_local_max
+# Heavy dependencies (cv2, skimage, astropy, photutils) are imported in the code paths using them, so that importing
+# galmask, e.g. in short-lived worker processes or CLI invocations, stays fast.
+from galmask.background import estimate_background, estimate_background_rms, estimate_background_stack
+from galmask.convolution import Convolver
+from galmask.utils import (
+    find_central_labels, find_farthest_peak_labels, getCenterBoundingBox, getCenterLabelRegion, label_stack
+)
 
-from astropy.io import fits
-from astropy.convolution import convolve, Gaussian2DKernel
-from astropy.stats import sigma_clipped_stats, gaussian_fwhm_to_sigma
-
-from photutils.background import MedianBackground, Background2D
-# from photutils.detection import find_peaks
-from photutils.datasets import apply_poisson_noise
-from photutils.segmentation import deblend_sources, detect_sources, detect_threshold
-
-from galmask.utils import find_farthest_label, find_closest_label, getLargestCC, getCenterLabelRegion
+MAX_AUTO_NLEVELS = 64
+STACK_CHUNK_SIZE = 64
 
 
 def galmask(
     image, npixels, nlevels, nsigma, contrast, min_distance, num_peaks, num_peaks_per_label,
-    connectivity=4, kernel=None, seg_image=None, mode="1", remove_local_max=True, deblend=False
+    connectivity=4, kernel=None, seg_image=None, mode="1", remove_local_max=True, deblend=False, convolve_method="auto",
+    background=None, background_rms=None, background_box_size=None, roi_pad=None, profiler=None, cache=None,
+    mask_dtype=float, out=None
 ):
     """Removes background source detections from input galaxy image.
 
@@ -26,8 +27,8 @@ def galmask(
     :type image: numpy.ndarray
     :param npixels: The no. of connected pixels that an object must have to be detected.
     :type npixels: int
-    :param nlevels: No. of multi-thresholding levels to be used for deblending.
-    :type nlevels: int
+    :param nlevels: No. of multi-thresholding levels to be used for deblending, or "auto" to start from a no. of levels suited to the dynamic range of the deblended sources and double it until the central source no longer changes (up to `MAX_AUTO_NLEVELS`).
+    :type nlevels: int or str
     :param nsigma: No. of standard deviations per pixel above the background to be considered as a part of source.
     :type nsigma: float
     :param contrast: Controls the level of deblending.
@@ -46,10 +47,28 @@ def galmask(
     :type seg_image: numpy.ndarray, optional
     :param mode: If "1", then performs connected component analysis else not, defaults to "1".
     :type mode: str, optional
-    :param remove_local_max: Whether to remove labels corresponding to peak local maximas far away from the center. If unsure, keep the default, defaults to `True`.
-    :type remove_local_max: bool, optional
-    :param deblend: Whether to deblend sources in the image. Set to True if there are nearby/overlapping sources in the image, defaults to `True`.
-    :type deblend: bool, optional
+    :param remove_local_max: Whether to remove the label of the peak local maxima farthest away from the center. An integer K removes the labels of the K farthest peaks. If unsure, keep the default, defaults to `True`.
+    :type remove_local_max: bool or int, optional
+    :param deblend: Whether to deblend sources in the image. Set to True if there are nearby/overlapping sources in the image. "central" only deblends the central source(s), see `galmask.utils.find_central_labels`, which is much faster for crowded images, but then local maxima removal sees each other source as a whole, defaults to `True`.
+    :type deblend: bool or str, optional
+    :param convolve_method: Convolution engine used for smoothing the image, one of "auto", "direct", "fft", "separable" or "opencv". All give the same result as "direct" (`astropy.convolution.convolve`) to within `galmask.convolution.CONVOLVE_RTOL` relative tolerance, see `galmask.convolution.convolve_image`, defaults to "auto".
+    :type convolve_method: str, optional
+    :param background: Precomputed background level or map (e.g. from `galmask.background.estimate_background`), defaults to the sigma-clipped median of the image.
+    :type background: float or numpy.ndarray, optional
+    :param background_rms: Precomputed background RMS level or map used for the detection threshold, defaults to the sigma-clipped standard deviation of the background-subtracted image.
+    :type background_rms: float or numpy.ndarray, optional
+    :param background_box_size: If given and `background` is None, estimate background and RMS maps on boxes of this size with `photutils.background.Background2D` instead of global levels, defaults to None.
+    :type background_box_size: int or tuple, optional
+    :param roi_pad: If given, deblending and connected component analysis only run on the bounding box of the central source(s) padded by `roi_pad` pixels, and the mask is pasted back into the full frame. Much faster for large images containing a small galaxy. Local maxima removal is skipped in this case since the far-away sources it targets lie outside the box. Sources extending beyond the padded box are cut at its edges, so use a padding large enough to contain the galaxy's close neighbours, defaults to None (whole image).
+    :type roi_pad: int, optional
+    :param profiler: Records the wall time (and optionally memory) of each stage of the call, see `galmask.profiling.StageProfiler`, defaults to None.
+    :type profiler: galmask.profiling.StageProfiler, optional
+    :param cache: Cache of results, keyed on a hash of the image, segmentation map, background, kernel and all the parameters. A cached result is returned without recomputing it, see `galmask.cache.ResultCache`, defaults to None.
+    :type cache: galmask.cache.ResultCache, optional
+    :param mask_dtype: Data type of the returned mask. Use bool for a mask 8 times smaller than the default float one, and see `galmask.utils.pack_mask`, `galmask.utils.encode_rle` and `galmask.utils.mask_bounding_box` for even more compact forms, defaults to float.
+    :type mask_dtype: data-type, optional
+    :param out: Array in which the masked image is written instead of allocating a new one, e.g. `image` itself to mask it in place. Must have the shape of `image` and a floating point dtype, defaults to None.
+    :type out: numpy.ndarray, optional
 
     :return cleaned_seg_img: Cleaned segmentation after removing unwanted source detections.
     :rtype: numpy.ndarray
@@ -58,70 +77,497 @@ def galmask(
     image appropriately.
 
     """
-    _img_shape = image.shape
-
-    # Convolve input image with a 2D kernel.
-    if kernel is None:  # Create a Gaussian kernel with FWHM = 3.
-        sigma = 3.0 * gaussian_fwhm_to_sigma
-        kernel = Gaussian2DKernel(sigma, x_size=3, y_size=3)
-        kernel.normalize()
-        kernel = kernel.array
-
-    if not np.allclose(np.sum(kernel), 1.0):
-        warnings.warn("Kernel is not normalized.")
-    if np.isclose(np.sum(kernel), 0.0):
-        raise ValueError("Kernel sum is close to zero. Cannot use it for convolution.")
-
-    bkg_level = MedianBackground().calc_background(image)
-    image_bkg_subtracted = image - bkg_level
-    convolved_data = convolve(image_bkg_subtracted, kernel, normalize_kernel=True)
-
-    if seg_image is None:
-        threshold = detect_threshold(image_bkg_subtracted, nsigma=nsigma, background=0.0)
-        # Since threshold includes background level, we do not subtract background from data that is input to detect_sources.
-        objects = detect_sources(convolved_data, threshold, npixels=npixels)
-        if objects is None:
-            raise ValueError("No source detection found in the image!")
-    else:
-        objects = seg_image.copy()
-        objects = objects.astype('uint8')
-
-    if mode == "0":
-        x = getCenterLabelRegion(objects)
-        galmasked = np.multiply(x, image)
+    masker = GalMasker(
+        npixels, nlevels, nsigma, contrast, min_distance, num_peaks, num_peaks_per_label, connectivity=connectivity,
+        kernel=kernel, mode=mode, remove_local_max=remove_local_max, deblend=deblend, convolve_method=convolve_method,
+        background_box_size=background_box_size, roi_pad=roi_pad, profiler=profiler, cache=cache, mask_dtype=mask_dtype
+    )
+    return masker(image, seg_image=seg_image, background=background, background_rms=background_rms, out=out)
+
+def galmask_multiband(
+    bands, npixels, nlevels, nsigma, contrast, min_distance, num_peaks, num_peaks_per_label,
+    detection_image=None, seg_image=None, background=None, background_rms=None, **kwargs
+):
+    """Removes background source detections from all the bands of a galaxy with a single mask.
+
+    Detection, deblending and source selection run once on the detection image, which defaults to the sum of the
+    bands, and the resulting mask is applied to every band. This costs about as much as a single `galmask` call.
+
+    :param bands: Images of the galaxy in several bands, all of the same shape: a list or a 3D array of shape (B, H, W).
+    :type bands: numpy.ndarray or list of numpy.ndarray
+    :param detection_image: Image used for detection and source selection, e.g. a band or a weighted coadd, defaults to the sum of the bands.
+    :type detection_image: numpy.ndarray, optional
+    :param seg_image: Segmentation map of the detection image.
+    :type seg_image: numpy.ndarray, optional
+    :param background: Precomputed background level or map of the detection image, defaults to None.
+    :type background: float or numpy.ndarray, optional
+    :param background_rms: Precomputed background RMS level or map of the detection image, defaults to None.
+    :type background_rms: float or numpy.ndarray, optional
+    :param kwargs: Other keyword arguments of `galmask`, e.g. `mode`, `deblend` or `kernel`.
+
+    :return galmasked: Bands with the background source detections removed, of shape (B, H, W).
+    :rtype: numpy.ndarray
+    :return x: Galaxy mask shared by all the bands.
+    :rtype: numpy.ndarray
+
+    """
+    masker = GalMasker(
+        npixels, nlevels, nsigma, contrast, min_distance, num_peaks, num_peaks_per_label, **kwargs
+    )
+    return masker.mask_bands(
+        bands, detection_image=detection_image, seg_image=seg_image, background=background, background_rms=background_rms
+    )
+
+@lru_cache(maxsize=1)
+def default_kernel():
+    """Gaussian kernel with FWHM = 3 used when no kernel is given. The returned array is read-only."""
+    from astropy.convolution import Gaussian2DKernel
+    from astropy.stats import gaussian_fwhm_to_sigma
+
+    sigma = 3.0 * gaussian_fwhm_to_sigma
+    kernel = Gaussian2DKernel(sigma, x_size=3, y_size=3)
+    kernel.normalize()
+    kernel = kernel.array
+    kernel.flags.writeable = False
+    return kernel
+
+
+class GalMasker:
+    """Reusable galmask configuration holding the state shared by all images.
+
+    The kernel is validated once and the convolution state (normalized kernel, separable factors, kernel FFTs per image
+    shape) is computed once, so masking many images, especially of the same shape, is cheaper than calling `galmask`
+    for each of them. Calling an instance on an image is equivalent to calling `galmask` with the same parameters.
+    Instances are thread-safe and can be pickled, e.g. to be sent to worker processes.
+
+    The parameters are the same as those of `galmask`.
+
+    :param cache_size: Maximum no. of image shapes for which the kernel FFT is cached (unrelated to `cache`), defaults to 8.
+    :type cache_size: int, optional
+
+    """
+    def __init__(
+        self, npixels, nlevels, nsigma, contrast, min_distance, num_peaks, num_peaks_per_label,
+        connectivity=4, kernel=None, mode="1", remove_local_max=True, deblend=False, convolve_method="auto",
+        background_box_size=None, roi_pad=None, profiler=None, cache=None, mask_dtype=float, cache_size=8
+    ):
+        if kernel is None:
+            kernel = default_kernel()
+
+        if not np.allclose(np.sum(kernel), 1.0):
+            warnings.warn("Kernel is not normalized.")
+        if np.isclose(np.sum(kernel), 0.0):
+            raise ValueError("Kernel sum is close to zero. Cannot use it for convolution.")
+
+        if deblend not in (False, True, "central"):
+            raise ValueError(f"Invalid deblend {deblend!r}, must be False, True or 'central'.")
+
+        self.npixels = npixels
+        self.nlevels = nlevels
+        self.nsigma = nsigma
+        self.contrast = contrast
+        self.min_distance = min_distance
+        self.num_peaks = num_peaks
+        self.num_peaks_per_label = num_peaks_per_label
+        self.connectivity = connectivity
+        self.mode = mode
+        self.remove_local_max = remove_local_max
+        self.deblend = deblend
+        self.background_box_size = background_box_size
+        self.roi_pad = roi_pad
+        self.profiler = profiler
+        self.cache = cache
+        self.mask_dtype = mask_dtype
+        self.convolver = Convolver(kernel, method=convolve_method, cache_size=cache_size)
+
+    @property
+    def kernel(self):
+        return self.convolver.kernel
+
+    def stage(self, name):
+        """Context manager recording the enclosed code as stage `name` of the profiler, if any."""
+        return nullcontext() if self.profiler is None else self.profiler.stage(name)
+
+    def background(self, image):
+        """Estimate the background level and RMS of the image in a single pass, see `galmask.background.estimate_background`.
+
+        :param image: Galaxy image.
+        :type image: numpy.ndarray
+
+        :return background: Background level or map.
+        :rtype: float or numpy.ndarray
+        :return background_rms: Background RMS level or map.
+        :rtype: float or numpy.ndarray
+
+        """
+        with self.stage("background"):
+            return estimate_background(image, box_size=self.background_box_size)
+
+    def smooth(self, image, background):
+        """Subtract the background from the image and convolve it with the kernel.
+
+        :param image: Galaxy image.
+        :type image: numpy.ndarray
+        :param background: Background level or map.
+        :type background: float or numpy.ndarray
+
+        :return image_bkg_subtracted: Background-subtracted image.
+        :rtype: numpy.ndarray
+        :return convolved_data: Background-subtracted image convolved with the kernel.
+        :rtype: numpy.ndarray
+
+        """
+        with self.stage("convolve"):
+            image_bkg_subtracted = image - background
+            convolved_data = self.convolver(image_bkg_subtracted)
+        return image_bkg_subtracted, convolved_data
+
+    def detect(self, convolved_data, background_rms, seg_image=None):
+        """Detect sources in the smoothed image, unless a segmentation map is given.
+
+        :param convolved_data: Background-subtracted image convolved with the kernel.
+        :type convolved_data: numpy.ndarray
+        :param background_rms: Background RMS level or map, unused if `seg_image` is given.
+        :type background_rms: float or numpy.ndarray
+        :param seg_image: Segmentation map.
+        :type seg_image: numpy.ndarray, optional
+
+        :return objects: Integer label map, which may be `seg_image` itself.
+        :rtype: numpy.ndarray
+
+        """
+        if seg_image is None:
+            from photutils.segmentation import detect_sources
+
+            with self.stage("detect"):
+                # The data is background-subtracted, so the threshold only consists of the noise term.
+                threshold = self.nsigma * background_rms
+                segm = detect_sources(convolved_data, threshold, npixels=self.npixels)
+            if segm is None:
+                raise ValueError("No source detection found in the image!")
+            objects = segm.data
+        else:
+            # Labels are kept as integers of at least 32 bits: casting to uint8 would wrap labels above 255 around, and
+            # the new labels of deblended pieces would not fit in e.g. a uint8 segmentation map.
+            objects = np.asarray(seg_image)
+            if not np.issubdtype(objects.dtype, np.integer):
+                objects = objects.astype(np.int32)
+            elif objects.dtype.itemsize < 4:
+                objects = objects.astype(np.promote_types(objects.dtype, np.int32))
+        return objects
+
+    def select(self, convolved_data, objects, center=None):
+        """Select the central galaxy from the segmentation map.
+
+        :param convolved_data: Background-subtracted image convolved with the kernel.
+        :type convolved_data: numpy.ndarray
+        :param objects: Integer label map, not modified.
+        :type objects: numpy.ndarray
+        :param center: (row, column) position of the galaxy, defaults to the center of the image.
+        :type center: tuple, optional
+
+        :return x: Boolean galaxy mask.
+        :rtype: numpy.ndarray
+
+        """
+        if center is None:
+            center = (objects.shape[0]/2, objects.shape[1]/2)
+        if self.mode == "0":
+            with self.stage("select"):
+                return getCenterLabelRegion(objects, center=center, dtype=bool)
+        if self.roi_pad is None:
+            return self._select(convolved_data, objects, center)
+
+        with self.stage("select"):
+            bbox = getCenterBoundingBox(objects, pad=self.roi_pad, center=center)
+        roi_center = (center[0] - bbox[0].start, center[1] - bbox[1].start)
+        x = np.zeros(objects.shape, dtype=bool)
+        x[bbox] = self._select(convolved_data[bbox], objects[bbox], roi_center, remove_local_max=False)
+        return x
+
+    def _select(self, convolved_data, objects, center, remove_local_max=None):
+        """Select the source closest to `center`, given in (row, column) pixel coordinates, after deblending."""
+        if remove_local_max is None:
+            remove_local_max = self.remove_local_max
+
+        if self.deblend:
+            with self.stage("deblend"):
+                segm_deblend = self._deblend(convolved_data, objects, center)
+        else:
+            segm_deblend = objects
+
+        if remove_local_max:
+            with self.stage("local_max"):
+                # Same peaks as `skimage.feature.peak_local_max`, found in a single vectorized pass for min_distance=1.
+                farthest = find_farthest_peak_labels(
+                    convolved_data, segm_deblend, center, self.min_distance, self.num_peaks, self.num_peaks_per_label,
+                    n_labels=int(remove_local_max)
+                )
+                if segm_deblend is objects:  # Do not modify the input segmentation map.
+                    segm_deblend = segm_deblend.copy()
+                # A single pass over the map: `ndimage.find_objects` would allocate a slice per label up to the largest one.
+                segm_deblend[np.isin(segm_deblend, farthest)] = 0
+
+        if self.mode == "1":
+            import cv2
+
+            with self.stage("connected_components"):
+                # Connected components only depend on which pixels are labelled, so binarize the labels instead of casting
+                # them to uint8 (which would turn labels that are multiples of 256 into background).
+                foreground = np.greater(segm_deblend, 0).view(np.uint8)
+                # Below line has issues with opencv-python-4.5.5.64, so to fix, downgrade the version.
+                nb_components, objects_connected = cv2.connectedComponents(foreground, connectivity=self.connectivity)  # We want to remove all detections far apart from the central galaxy.
+            with self.stage("select"):
+                x = getCenterLabelRegion(objects_connected, center=center, dtype=bool)
+        elif self.mode == "2":
+            with self.stage("select"):
+                x = getCenterLabelRegion(segm_deblend, center=center, dtype=bool)
+
+        return x
+
+    def _deblend(self, convolved_data, objects, center):
+        """Deblend the sources of the segmentation map, or only the central one(s) if `deblend` is "central"."""
+        from photutils.segmentation import SegmentationImage, deblend_sources
+
+        def deblend(data, segm, nlevels):
+            return deblend_sources(
+                data, segm, npixels=self.npixels, nlevels=nlevels, contrast=self.contrast, progress_bar=False
+            ).data
+
+        if self.deblend is True and self.nlevels != "auto":
+            return deblend(convolved_data, SegmentationImage(objects), self.nlevels)
+
+        # Sources are deblended independently of each other, so the central ones are deblended on their bounding box
+        # only, with the other sources removed, which gives the same pieces as deblending the whole map.
+        central = find_central_labels(objects, center=center)
+        bbox = getCenterBoundingBox(objects, center=center)
+        cutout = objects[bbox]
+        in_central = np.isin(cutout, central)
+        # The pieces are relabelled below, so photutils is given consecutive labels, which keeps its per-label arrays
+        # small whatever the label values.
+        segm = SegmentationImage(np.where(in_central, np.searchsorted(central, cutout) + 1, 0))
+        data = convolved_data[bbox]
+        cutout_center = (center[0] - bbox[0].start, center[1] - bbox[1].start)
+
+        if self.nlevels == "auto":
+            # One level per factor of 2 between the faintest and brightest pixels of the central source(s) to start
+            # with, since photutils spaces the levels exponentially. The no. of levels is then doubled until the
+            # central piece no longer changes.
+            values = data[in_central & (data > 0)]
+            dynamic_range = values.max() / values.min() if values.size else 1.0
+            nlevels = int(np.clip(np.ceil(np.log2(dynamic_range)), 4, MAX_AUTO_NLEVELS))
+            pieces = deblend(data, segm, nlevels)
+            piece = getCenterLabelRegion(pieces, center=cutout_center, dtype=bool)
+            while nlevels < MAX_AUTO_NLEVELS:
+                finer_pieces = deblend(data, segm, min(2 * nlevels, MAX_AUTO_NLEVELS))
+                finer_piece = getCenterLabelRegion(finer_pieces, center=cutout_center, dtype=bool)
+                if np.array_equal(finer_piece, piece):
+                    break
+                nlevels, pieces, piece = min(2 * nlevels, MAX_AUTO_NLEVELS), finer_pieces, finer_piece
+            if self.deblend is True:
+                return deblend(convolved_data, SegmentationImage(objects), nlevels)
+        else:
+            pieces = deblend(data, segm, self.nlevels)
+
+        # The pieces take the labels of the central sources, then new labels after the largest one.
+        n_pieces = int(pieces.max())
+        max_label = int(objects.max())
+        dtype = objects.dtype if max_label + n_pieces <= np.iinfo(objects.dtype).max else np.int64
+        lut = np.concatenate(([0], central, np.arange(max_label + 1, max_label + 1 + n_pieces))).astype(dtype)
+        segm_deblend = objects.astype(dtype)
+        segm_deblend[bbox][in_central] = lut[pieces[in_central]]
+        return segm_deblend
+
+    def mask(self, image, seg_image=None, background=None, background_rms=None, center=None):
+        """Compute the galaxy mask of an image without applying it, see `galmask`.
+
+        :param image: Galaxy image.
+        :type image: numpy.ndarray
+        :param seg_image: Segmentation map.
+        :type seg_image: numpy.ndarray, optional
+        :param background: Precomputed background level or map, defaults to None.
+        :type background: float or numpy.ndarray, optional
+        :param background_rms: Precomputed background RMS level or map, defaults to None.
+        :type background_rms: float or numpy.ndarray, optional
+        :param center: (row, column) position of the galaxy, defaults to the center of the image.
+        :type center: tuple, optional
+
+        :return x: Galaxy mask.
+        :rtype: numpy.ndarray
+
+        """
+        if background is None:
+            background, estimated_rms = self.background(image)
+            if background_rms is None:
+                background_rms = estimated_rms
+        image_bkg_subtracted, convolved_data = self.smooth(image, background)
+        if seg_image is None and background_rms is None:
+            with self.stage("background"):
+                background_rms = estimate_background_rms(image_bkg_subtracted)
+        objects = self.detect(convolved_data, background_rms, seg_image=seg_image)
+        return self.select(convolved_data, objects, center=center).astype(self.mask_dtype, copy=False)
+
+    def __call__(self, image, seg_image=None, background=None, background_rms=None, out=None):
+        """Remove background source detections from a galaxy image, see `galmask`.
+
+        :param image: Galaxy image.
+        :type image: numpy.ndarray
+        :param seg_image: Segmentation map.
+        :type seg_image: numpy.ndarray, optional
+        :param background: Precomputed background level or map, defaults to None.
+        :type background: float or numpy.ndarray, optional
+        :param background_rms: Precomputed background RMS level or map, defaults to None.
+        :type background_rms: float or numpy.ndarray, optional
+        :param out: Array in which the masked image is written, e.g. `image` itself to mask it in place, defaults to None.
+        :type out: numpy.ndarray, optional
+
+        :return galmasked: Galaxy image with the background source detections removed, `out` if given.
+        :rtype: numpy.ndarray
+        :return x: Galaxy mask.
+        :rtype: numpy.ndarray
+
+        """
+        if self.cache is not None:
+            key = self.cache_key(image, seg_image=seg_image, background=background, background_rms=background_rms)
+            result = self.cache.get(key)
+            if result is not None:
+                if out is not None:
+                    out[...] = result[0]
+                    result = out, result[1]
+                return result
+
+        x = self.mask(image, seg_image=seg_image, background=background, background_rms=background_rms)
+        with self.stage("apply"):
+            galmasked = np.multiply(x, image, out=out)
+
+        if self.cache is not None:
+            self.cache.put(key, (galmasked, x))
         return galmasked, x
 
-    if deblend:
-        segm_deblend = deblend_sources(convolved_data, objects, npixels=npixels, nlevels=nlevels, contrast=contrast).data
-    else:
-        segm_deblend = objects.copy()
+    def cache_key(self, image, seg_image=None, background=None, background_rms=None):
+        """Key of the result of a call in `cache`: a hash of the inputs, the kernel and all the parameters."""
+        from galmask.cache import cache_key
 
-    if remove_local_max:
-        local_max = peak_local_max(
-            convolved_data, min_distance=min_distance, num_peaks=num_peaks, num_peaks_per_label=num_peaks_per_label, labels=segm_deblend
+        return cache_key(
+            image, seg_image, background, background_rms, self.kernel, npixels=self.npixels, nlevels=self.nlevels,
+            nsigma=self.nsigma, contrast=self.contrast, min_distance=self.min_distance, num_peaks=self.num_peaks,
+            num_peaks_per_label=self.num_peaks_per_label, connectivity=self.connectivity, mode=self.mode,
+            remove_local_max=self.remove_local_max, deblend=self.deblend, convolve_method=self.convolver.method,
+            background_box_size=self.background_box_size, roi_pad=self.roi_pad, mask_dtype=np.dtype(self.mask_dtype).str
         )
-        index = find_farthest_label(local_max, _img_shape[0]/2, _img_shape[1]/2)
-        val = segm_deblend[local_max[index][0], local_max[index][1]]
-        segm_deblend[segm_deblend==val] = 0
-
-    segm_deblend_copy = segm_deblend.copy()
-
-    if mode == "1":
-        segm_deblend_copy = segm_deblend_copy.astype('uint8')
-        # Below line has issues with opencv-python-4.5.5.64, so to fix, downgrade the version.
-        nb_components, objects_connected, stats, centroids = cv2.connectedComponentsWithStats(segm_deblend_copy, connectivity=connectivity)  # We want to remove all detections far apart from the central galaxy.
-        max_label, max_size = max([(i, stats[i, cv2.CC_STAT_AREA]) for i in range(1, nb_components)], key=lambda x: x[1])
-        # The below lines of code are to ensure that if the central source (which is of concern) is not of maximum area, then we should
-        # not remove it, and instead select the center source by giving it more priority than area-wise selection. If indeed the central
-        # source is of the greatest area, then we can just select it.
-        closest_to_center_label = find_closest_label(centroids[1:, :], _img_shape[0]/2, _img_shape[1]/2)  # The first row in `centroids` corresponds to the whole image which we do not want. So consider all rows except the first.
-        if closest_to_center_label == max_label:
-            x = (objects_connected == max_label).astype(float)
-        else:
-            x = (objects_connected == closest_to_center_label).astype(float)
-    elif mode == "2":
-        x = getCenterLabelRegion(segm_deblend_copy)
 
-    galmasked = np.multiply(x, image)
+    def mask_bands(self, bands, detection_image=None, seg_image=None, background=None, background_rms=None):
+        """Mask all the bands of a galaxy with a single mask, computed once from a detection image.
+
+        :param bands: Images of the galaxy in several bands, all of the same shape: a list or a 3D array of shape (B, H, W).
+        :type bands: numpy.ndarray or list of numpy.ndarray
+        :param detection_image: Image used for detection and source selection, defaults to the sum of the bands.
+        :type detection_image: numpy.ndarray, optional
+        :param seg_image: Segmentation map of the detection image.
+        :type seg_image: numpy.ndarray, optional
+        :param background: Precomputed background level or map of the detection image, defaults to None.
+        :type background: float or numpy.ndarray, optional
+        :param background_rms: Precomputed background RMS level or map of the detection image, defaults to None.
+        :type background_rms: float or numpy.ndarray, optional
+
+        :return galmasked: Bands with the background source detections removed, of shape (B, H, W).
+        :rtype: numpy.ndarray
+        :return x: Galaxy mask shared by all the bands.
+        :rtype: numpy.ndarray
+
+        """
+        bands = np.asarray(bands)
+        if bands.ndim != 3:
+            raise ValueError("Bands must be a list of images of the same shape or a 3D array of shape (B, H, W).")
+        if detection_image is None:
+            detection_image = bands.sum(axis=0)
+        elif np.shape(detection_image) != bands.shape[1:]:
+            raise ValueError("The detection image must have the same shape as the bands.")
+
+        x = self.mask(detection_image, seg_image=seg_image, background=background, background_rms=background_rms)
+        with self.stage("apply"):
+            galmasked = np.multiply(x, bands)
+        return galmasked, x
+
+    def iter_stack(self, images, seg_images=None, chunk_size=STACK_CHUNK_SIZE):
+        """Lazily compute the galaxy masks of a stack of equal-size images, see `mask_stack`.
+
+        The images are processed in chunks of `chunk_size` images. The background estimation, smoothing and detection
+        thresholding of all the images of a chunk are done upfront with vectorized operations, the label-dependent
+        steps (deblending, local maxima removal and source selection) then run for one image at a time. Only one
+        chunk is read at a time, so memory use does not grow with the no. of images, e.g. of a memory-mapped stack.
+
+        :param images: Stack of galaxy images of shape (N, H, W).
+        :type images: numpy.ndarray
+        :param seg_images: Segmentation maps, one per image (entries may be None).
+        :type seg_images: numpy.ndarray or list of numpy.ndarray, optional
+        :param chunk_size: No. of images processed at once, defaults to `STACK_CHUNK_SIZE`.
+        :type chunk_size: int, optional
 
-    return galmasked, x
+        :return: Generator of `(x, error)` tuples in input order. `x` is the galaxy mask and `error` is None on success, else `x` is None and `error` is the raised exception.
+        :rtype: generator
+
+        """
+        if not isinstance(images, np.ndarray):
+            images = np.asarray(images)
+        if images.ndim != 3:
+            raise ValueError("A stack of images must be a 3D array of shape (N, H, W).")
+        seg_images = [None] * len(images) if seg_images is None else list(seg_images)
+        if len(seg_images) != len(images):
+            raise ValueError("`seg_images` must have one entry per image.")
+
+        for start in range(0, len(images), chunk_size):
+            chunk = np.asarray(images[start:start + chunk_size])  # Read from disk here for a memory-mapped stack.
+            yield from self._iter_chunk(chunk, seg_images[start:start + chunk_size])
+
+    def _iter_chunk(self, images, seg_images):
+        if self.background_box_size is None:
+            with self.stage("background"):
+                background, background_rms = estimate_background_stack(images)
+        else:  # Background maps are estimated per image.
+            background, background_rms = map(np.stack, zip(*(self.background(image) for image in images)))
+        _, convolved_data = self.smooth(images, background.reshape(-1, 1, 1) if background.ndim == 1 else background)
+
+        if any(seg_image is None for seg_image in seg_images):
+            with self.stage("detect"):
+                threshold = self.nsigma * (background_rms.reshape(-1, 1, 1) if background_rms.ndim == 1 else background_rms)
+                labels = label_stack(np.greater(convolved_data, threshold), self.npixels)
+
+        for i, seg_image in enumerate(seg_images):
+            try:
+                if seg_image is None:
+                    if not labels[i].any():
+                        raise ValueError("No source detection found in the image!")
+                    objects = labels[i]
+                else:
+                    objects = self.detect(convolved_data[i], None, seg_image=seg_image)
+                yield self.select(convolved_data[i], objects).astype(self.mask_dtype, copy=False), None
+            except Exception as exc:  # Reported per image, as by `galmask.batch.galmask_batch`.
+                yield None, exc
+
+    def mask_stack(self, images, seg_images=None):
+        """Remove background source detections from a stack of equal-size images, e.g. postage stamps of a catalog.
+
+        Gives the same results as calling the masker on each image, but the image-wise steps run on the whole stack
+        at once, which removes most of the per-call overhead for small images, see `iter_stack`.
+
+        :param images: Stack of galaxy images of shape (N, H, W).
+        :type images: numpy.ndarray
+        :param seg_images: Segmentation maps, one per image (entries may be None).
+        :type seg_images: numpy.ndarray or list of numpy.ndarray, optional
+
+        :return galmasked: Images with the background source detections removed, of shape (N, H, W).
+        :rtype: numpy.ndarray
+        :return x: Galaxy masks, of shape (N, H, W).
+        :rtype: numpy.ndarray
+
+        """
+        masks = []
+        for x, error in self.iter_stack(images, seg_images=seg_images):
+            if error is not None:
+                raise error
+            masks.append(x)
+        x = np.stack(masks)
+        with self.stage("apply"):
+            galmasked = np.multiply(x, images)
+        return galmasked, x
@@ -0,0 +1,166 @@
+import os
+import glob
+from collections import deque
+
+import numpy as np
+
+from galmask.batch import galmask_imap
+
+
+def iter_fits_images(path, ext=0, seg_ext=None, pattern="*.fits"):
+    """Lazily iterate over the galaxy images of FITS files.
+
+    Files are opened with memory mapping, so only the images currently being processed are read from disk.
+
+    :param path: Directory containing one galaxy image per FITS file, a list of such FITS files, or a multi-extension FITS file containing one galaxy image per HDU.
+    :type path: str or list of str
+    :param ext: Extension holding the image in each file (directory or list input only), defaults to 0.
+    :type ext: int or str, optional
+    :param seg_ext: Extension holding the segmentation map in each file (directory or list input only), defaults to None.
+    :type seg_ext: int or str, optional
+    :param pattern: Glob pattern used to select files in the directory, defaults to "*.fits".
+    :type pattern: str, optional
+
+    :return: Generator of `(name, image, seg_image, header)` tuples. `seg_image` is None if `seg_ext` is None.
+    :rtype: generator
+
+    """
+    from astropy.io import fits
+
+    if not isinstance(path, str):
+        filenames = path
+    elif os.path.isdir(path):
+        filenames = sorted(glob.glob(os.path.join(path, pattern)))
+    else:
+        if seg_ext is not None:
+            raise ValueError("`seg_ext` is only supported for a directory or a list of FITS files.")
+        stem = os.path.splitext(os.path.basename(path))[0]
+        with fits.open(path, memmap=True) as hdul:
+            for i, hdu in enumerate(hdul):
+                if hdu.is_image and hdu.header.get("NAXIS") == 2:
+                    yield f"{stem}_{i}", hdu.data, None, hdu.header
+        return
+
+    for filename in filenames:
+        name = os.path.splitext(os.path.basename(filename))[0]
+        with fits.open(filename, memmap=True) as hdul:
+            seg_image = None if seg_ext is None else hdul[seg_ext].data
+            yield name, hdul[ext].data, seg_image, hdul[ext].header
+
+def write_galmask_hdus(filename, galmasked, mask, header=None, overwrite=False):
+    """Write galmask outputs to a FITS file: the masked image in the primary HDU and the mask in the "MASK" extension.
+
+    :param filename: Output FITS file.
+    :type filename: str
+    :param galmasked: Masked galaxy image.
+    :type galmasked: numpy.ndarray
+    :param mask: Galaxy mask.
+    :type mask: numpy.ndarray
+    :param header: Header of the input image, copied to the primary HDU, defaults to None.
+    :type header: astropy.io.fits.Header, optional
+    :param overwrite: Whether to overwrite an existing file, defaults to False.
+    :type overwrite: bool, optional
+
+    """
+    from astropy.io import fits
+
+    hdul = fits.HDUList([
+        fits.PrimaryHDU(galmasked, header=None if header is None else header.copy()),
+        fits.ImageHDU(mask.astype(np.uint8), name="MASK")
+    ])
+    hdul.writeto(filename, overwrite=overwrite)
+
+def append_hdu(filename, data, name, header=None):
+    """Append an image extension to a FITS file without reading its existing HDUs.
+
+    The file is created with an empty primary HDU if it does not exist.
+
+    :param filename: Output FITS file.
+    :type filename: str
+    :param data: Image data.
+    :type data: numpy.ndarray
+    :param name: Extension name.
+    :type name: str
+    :param header: Header whose keywords are copied to the extension, defaults to None.
+    :type header: astropy.io.fits.Header, optional
+
+    """
+    from astropy.io import fits
+
+    if not os.path.exists(filename):
+        fits.PrimaryHDU().writeto(filename)
+    hdu_header = fits.ImageHDU(data=data, header=None if header is None else header.copy(), name=name).header
+    shdu = fits.StreamingHDU(filename, hdu_header)
+    try:
+        shdu.write(data)
+    finally:
+        shdu.close()
+
+def stream_galmask(
+    path, output=None, ext=0, seg_ext=None, pattern="*.fits", n_jobs=1, executor="process", max_pending=None,
+    overwrite=False, **kwargs
+):
+    """Stream galaxy images from FITS files through galmask, writing the outputs incrementally.
+
+    Images are read with memory mapping and at most `max_pending` of them are in flight at any time, so peak memory
+    does not grow with the size of the catalog.
+
+    :param path: Directory of FITS files, list of FITS files or a multi-extension FITS file, see `iter_fits_images`.
+    :type path: str or list of str
+    :param output: Where to write the outputs. If a directory, each image is written to `<name>_galmask.fits` (see `write_galmask_hdus`). If a path ending in ".fits", the masked image and mask of each input are appended to this single file as `<name>` and `<name>_MASK` extensions. If None, nothing is written, defaults to None.
+    :type output: str, optional
+    :param ext: Extension holding the image in each file (directory or list input only), defaults to 0.
+    :type ext: int or str, optional
+    :param seg_ext: Extension holding the segmentation map in each file (directory or list input only), defaults to None.
+    :type seg_ext: int or str, optional
+    :param pattern: Glob pattern used to select files in the directory, defaults to "*.fits".
+    :type pattern: str, optional
+    :param n_jobs: No. of workers, defaults to 1.
+    :type n_jobs: int, optional
+    :param executor: Either "process", "thread" or an existing `concurrent.futures.Executor`, defaults to "process".
+    :type executor: str or concurrent.futures.Executor, optional
+    :param max_pending: Maximum no. of images in flight, defaults to `4 * n_jobs`.
+    :type max_pending: int, optional
+    :param overwrite: Whether to overwrite existing output files, defaults to False.
+    :type overwrite: bool, optional
+    :param kwargs: Keyword arguments passed to `galmask`.
+
+    :return: Generator of `(name, result, error)` tuples, in input order. `result` is the `(galmasked, mask)` tuple or None if galmask failed for this image, in which case `error` holds the exception.
+    :rtype: generator
+
+    """
+    single_file = output is not None and output.lower().endswith(".fits")
+    if single_file and os.path.exists(output):
+        if not overwrite:
+            raise OSError(f"File {output!r} already exists.")
+        os.remove(output)
+    elif output is not None and not single_file:
+        os.makedirs(output, exist_ok=True)
+
+    # Names, headers and segmentation maps of the images read but not yet yielded. The images are read lazily by
+    # `galmask_imap`, which takes the segmentation map of each image right after the image itself.
+    inputs, seg_images = deque(), deque()
+
+    def images():
+        for name, image, seg_image, header in iter_fits_images(path, ext=ext, seg_ext=seg_ext, pattern=pattern):
+            inputs.append((name, header))
+            seg_images.append(seg_image)
+            yield image
+
+    def segs():
+        while True:
+            yield seg_images.popleft()
+
+    results = galmask_imap(
+        images(), seg_images=segs(), n_jobs=n_jobs, executor=executor, max_pending=max_pending, **kwargs
+    )
+    for result, error in results:
+        name, header = inputs.popleft()
+        if result is not None and output is not None:
+            galmasked, mask = result
+            if single_file:
+                append_hdu(output, galmasked, name, header=header)
+                append_hdu(output, mask.astype(np.uint8), f"{name}_MASK")
+            else:
+                write_galmask_hdus(os.path.join(output, f"{name}_galmask.fits"), galmasked, mask, header=header, overwrite=overwrite)
+        yield name, result, error
@@ -0,0 +1,98 @@
+import os
+
+import numpy as np
+
+from galmask.batch import imap_bounded, worker_masker
+from galmask.galmask import GalMasker
+
+
+def cutout_slices(shape, center, size):
+    """Slices of the cutout of size `size` centered on `center`, clipped to an image of shape `shape`.
+
+    :param shape: Shape of the image.
+    :type shape: tuple
+    :param center: (row, column) position of the cutout center.
+    :type center: tuple
+    :param size: Cutout size, either a single int for square cutouts or (height, width).
+    :type size: int or tuple
+
+    :return bbox: Row and column slices of the cutout.
+    :rtype: tuple of slice
+    :return center: (row, column) position of `center` in the cutout.
+    :rtype: tuple
+
+    """
+    size = (size, size) if np.isscalar(size) else size
+    starts = [int(round(c)) - n // 2 for c, n in zip(center, size)]
+    bbox = tuple(slice(max(start, 0), min(start + n, s)) for start, n, s in zip(starts, size, shape))
+    return bbox, tuple(c - b.start for c, b in zip(center, bbox))
+
+def _mask_cutout(masker, cutout, center):
+    masker = worker_masker(masker)
+    try:
+        return masker.mask(cutout, center=center).astype(bool, copy=False), None
+    except Exception as exc:  # A failure for one galaxy (e.g. no source detected) must not abort the whole mosaic.
+        return None, exc
+
+def galmask_mosaic(image, centers, cutout_size, n_jobs=None, executor="thread", max_pending=None, out=None, **kwargs):
+    """Mask many galaxies of a large image, e.g. a survey tile, given a catalog of their positions.
+
+    The cutout around each galaxy is a view of `image`, masked as by `galmask` with the galaxy at the given position
+    instead of the cutout center, so that galaxies close to the edges of the image are supported. The cutouts are
+    masked in parallel and their masks are stitched into a full-frame label map where the pixels of the i-th galaxy
+    are labelled i + 1, and 0 is the background. Where the masks of several galaxies overlap, the pixels get the
+    label of the galaxy that comes first in `centers`, i.e. the smallest label. As with `galmask`, local maxima
+    removal discards the source farthest from the galaxy, so use `remove_local_max=False` for cutouts that may
+    contain no other source.
+
+    At most `max_pending` cutouts are processed at a time, in order of increasing row, so that with a memory-mapped
+    `image` (e.g. `astropy.io.fits` data opened with `memmap=True`) and `out` (e.g. `numpy.lib.format.open_memmap`),
+    only a band of the mosaic is held in memory.
+
+    :param image: Full image.
+    :type image: numpy.ndarray
+    :param centers: (row, column) pixel positions of the galaxies.
+    :type centers: iterable of tuple
+    :param cutout_size: Size of the cutout masked around each galaxy, either a single int for square cutouts or (height, width).
+    :type cutout_size: int or tuple
+    :param n_jobs: No. of workers, defaults to the no. of CPUs.
+    :type n_jobs: int, optional
+    :param executor: Either "thread", "process" or an existing `concurrent.futures.Executor`, defaults to "thread". Threads share the cutouts without copying them, while processes receive a copy of each cutout.
+    :type executor: str or concurrent.futures.Executor, optional
+    :param max_pending: Maximum no. of cutouts being processed at a time, defaults to `4 * n_jobs`.
+    :type max_pending: int, optional
+    :param out: Integer array of the shape of `image` in which the labels are written, defaults to a new int32 array.
+    :type out: numpy.ndarray, optional
+    :param kwargs: Keyword arguments of `galmask` (e.g. `npixels`, `nlevels`, `mode`).
+
+    :return labels: Label map of the galaxy masks, `out` if given.
+    :rtype: numpy.ndarray
+    :return failures: Mapping from the index of each galaxy that could not be masked to the raised exception.
+    :rtype: dict
+
+    """
+    n_jobs = n_jobs or os.cpu_count() or 1
+    masker = GalMasker(**kwargs)
+    labels = np.zeros(image.shape, dtype=np.int32) if out is None else out
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    order = np.argsort(centers[:, 0], kind="stable")
+
+    def stitch(index, bbox, result):
+        mask, error = result
+        if error is not None:
+            failures[int(index)] = error
+            return
+        region = labels[bbox]
+        # Cutouts are stitched in row order, so a pixel already labelled by a galaxy later in `centers` is taken over.
+        region[mask & ((region == 0) | (region > index + 1))] = index + 1
+
+    failures = {}
+
+    def tasks():
+        for index in order:
+            bbox, center = cutout_slices(image.shape, centers[index], cutout_size)
+            yield (index, bbox), (image[bbox], center)
+
+    for (index, bbox), result in imap_bounded(_mask_cutout, tasks(), masker, n_jobs, executor, max_pending):
+        stitch(index, bbox, result)
+    return labels, dict(sorted(failures.items()))
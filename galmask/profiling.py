@@ -0,0 +1,143 @@
+import io
+import csv
+import json
+import time
+import threading
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+SUMMARY_FIELDS = ("stage", "count", "total", "mean", "p50", "p95", "max", "max_memory")
+
+# Memory is only traced while stages tracking it are running, in any thread, unless tracing was already started by
+# someone else, in which case it is left as is.
+_tracing_lock = threading.Lock()
+_tracing_stages = 0
+_started_tracing = False
+
+
+def _start_tracing():
+    global _tracing_stages, _started_tracing
+    with _tracing_lock:
+        if _tracing_stages == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _tracing_stages += 1
+
+def _stop_tracing():
+    global _tracing_stages, _started_tracing
+    with _tracing_lock:
+        _tracing_stages -= 1
+        if _tracing_stages == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+class StageProfiler:
+    """Records the wall time and memory allocated by each stage of galmask calls, aggregated over many calls.
+
+    Pass an instance as the `profiler` argument of `galmask`, `GalMasker` or `galmask_batch`. The stages are
+    "background", "convolve", "detect", "deblend", "local_max", "connected_components", "select" and "apply".
+    Instances are thread-safe and can be shared by the threads of a batch. Records made in worker processes are sent
+    back and merged by `galmask_batch`.
+
+    :param track_memory: Whether to record the peak memory allocated by each stage with `tracemalloc`. Tracing is started for the duration of the stages only (if it is not already on), which slows them down, and the peaks include allocations made concurrently by other threads, defaults to False.
+    :type track_memory: bool, optional
+    :param callback: Function called as `callback(stage, seconds, memory)` after each stage, `memory` being None if memory is not tracked, defaults to None.
+    :type callback: callable, optional
+
+    """
+    def __init__(self, track_memory=False, callback=None):
+        self.track_memory = track_memory
+        self.callback = callback
+        self._records = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):  # Records are not copied to worker processes, see `pop_records`.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_records"] = defaultdict(list)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager recording the wall time and allocated memory of the enclosed code as stage `name`."""
+        memory = None
+        if self.track_memory:
+            _start_tracing()
+            if hasattr(tracemalloc, "reset_peak"):  # Python >= 3.9
+                tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if self.track_memory:
+                memory = max(tracemalloc.get_traced_memory()[1] - start_memory, 0)
+                _stop_tracing()
+            self.record(name, seconds, memory)
+
+    def record(self, name, seconds, memory=None):
+        """Add a record for stage `name`."""
+        with self._lock:
+            self._records[name].append((seconds, memory))
+        if self.callback is not None:
+            self.callback(name, seconds, memory)
+
+    def pop_records(self):
+        """Remove and return all records, as a dict mapping each stage to a list of `(seconds, memory)` tuples."""
+        with self._lock:
+            records, self._records = dict(self._records), defaultdict(list)
+        return records
+
+    def merge(self, records):
+        """Add records returned by `pop_records` of another profiler, e.g. one used in a worker process."""
+        with self._lock:
+            for name, stage_records in records.items():
+                self._records[name].extend(stage_records)
+
+    def summary(self):
+        """Aggregate the records of each stage.
+
+        :return summary: One dict per stage, in the order the stages were first recorded, with keys `SUMMARY_FIELDS`: no. of calls, total, mean, median, 95th percentile and maximum wall time in seconds, and maximum memory in bytes (None if memory is not tracked).
+        :rtype: list of dict
+
+        """
+        with self._lock:
+            records = {name: list(stage_records) for name, stage_records in self._records.items()}
+        summary = []
+        for name, stage_records in records.items():
+            seconds = np.array([record[0] for record in stage_records])
+            memories = [record[1] for record in stage_records if record[1] is not None]
+            summary.append({
+                "stage": name, "count": len(seconds), "total": float(seconds.sum()), "mean": float(seconds.mean()),
+                "p50": float(np.percentile(seconds, 50)), "p95": float(np.percentile(seconds, 95)), "max": float(seconds.max()),
+                "max_memory": max(memories) if memories else None
+            })
+        return summary
+
+    def to_json(self, filename=None):
+        """Export the summary as JSON, to `filename` if given, else as a string."""
+        text = json.dumps(self.summary(), indent=2)
+        if filename is None:
+            return text
+        with open(filename, "w") as f:
+            f.write(text)
+
+    def to_csv(self, filename=None):
+        """Export the summary as CSV, to `filename` if given, else as a string."""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(self.summary())
+        if filename is None:
+            return buffer.getvalue()
+        with open(filename, "w", newline="") as f:
+            f.write(buffer.getvalue())
@@ -1,7 +1,5 @@
 import numpy as np
 
-from skimage.measure import label, regionprops
-
 
 # Below two functions are faster than numpy for small coordinate arrays.
 def find_farthest_label(coords, refx, refy):  # TODO: This function is slow and inefficient -- rewrite using standard libraries.
@@ -52,23 +50,380 @@ def getLargestCC(segmentation):
     :rtype: numpy.ndarray
 
     """
+    from skimage.measure import label
+
     # From https://stackoverflow.com/questions/47540926/get-the-largest-connected-component-of-segmentation-image
     labels = label(segmentation)
     assert labels.max() != 0, "There must be atleast one connected component in the segmentation image!"
     largestCC = labels == np.argmax(np.bincount(labels.flat)[1:]) + 1
     return largestCC
 
-def getCenterLabelRegion(objects):
-    _img_shape = objects.shape
-    _num_labels = len(np.unique(objects)) - 1  # Ignore background label (= 0).
-    props = regionprops(objects)
-    centroids = np.array([props[i].centroid for i in range(_num_labels)])
-    areas = np.array([props[i].area for i in range(_num_labels)])
-    max_label = props[np.argmax(areas)].label   # Need to add one since regionprops ignores background label 0.
-    closest_to_center_label = find_closest_label(centroids, _img_shape[0]/2, _img_shape[1]/2)
-
-    if max_label == props[closest_to_center_label-1].label:
-        x = (objects == max_label).astype(float)
+def label_stats(labels):
+    """Compute the area and centroid of every label of a label map in a single vectorized pass.
+
+    :param labels: Label map, 0 being the background.
+    :type labels: numpy.ndarray
+
+    :return label_ids: Labels present in the map, in increasing order.
+    :rtype: numpy.ndarray
+    :return areas: No. of pixels of each label.
+    :rtype: numpy.ndarray
+    :return centroids: (row, column) centroid of each label.
+    :rtype: numpy.ndarray
+
+    """
+    rows, cols = np.nonzero(labels)
+    values = labels[rows, cols]
+    if values.size and values.max() > 4 * values.size:
+        # `np.bincount` allocates up to the largest label, so sparse labels (e.g. IDs from a catalog) are compacted first.
+        label_ids, values = np.unique(values, return_inverse=True)
+        areas = np.bincount(values)
+        index = slice(None)
     else:
-        x = (objects == closest_to_center_label).astype(float)
-    return x
+        counts = np.bincount(values)
+        label_ids = np.flatnonzero(counts)
+        areas = counts[label_ids]
+        index = label_ids
+    centroids = np.column_stack((
+        np.bincount(values, weights=rows)[index] / areas,
+        np.bincount(values, weights=cols)[index] / areas
+    ))
+    return label_ids, areas, centroids
+
+def getCenterLabelRegion(objects, center=None, dtype=float):
+    """Select the label of a label map closest to the center of the image.
+
+    The central source is selected even if it is not the largest one, i.e. the distance to the center takes priority
+    over area-wise selection.
+
+    :param objects: Label map, 0 being the background.
+    :type objects: numpy.ndarray
+    :param center: (row, column) reference position, defaults to the center of the image.
+    :type center: tuple, optional
+    :param dtype: Data type of the returned array, e.g. bool for a compact mask, defaults to float.
+    :type dtype: data-type, optional
+
+    :return x: Array equal to 1 on the selected label and 0 elsewhere.
+    :rtype: numpy.ndarray
+
+    """
+    label_ids, _, centroids = label_stats(objects)
+    if len(label_ids) == 0:
+        raise ValueError("The segmentation map does not contain any source.")
+    if center is None:
+        center = (objects.shape[0]/2, objects.shape[1]/2)
+    closest_to_center_label = label_ids[find_closest_label(centroids, *center) - 1]
+    return (objects == closest_to_center_label).astype(dtype, copy=False)
+
+def find_central_labels(objects, center=None):
+    """Find the central source(s) of a label map.
+
+    The central sources are the label covering the center and the label whose centroid is closest to the center.
+
+    :param objects: Label map, 0 being the background.
+    :type objects: numpy.ndarray
+    :param center: (row, column) reference position, defaults to the center of the image.
+    :type center: tuple, optional
+
+    :return labels: Sorted label values of the central source(s), one or two of them.
+    :rtype: numpy.ndarray
+
+    """
+    label_ids, _, centroids = label_stats(objects)
+    if len(label_ids) == 0:
+        raise ValueError("The segmentation map does not contain any source.")
+    if center is None:
+        center = (objects.shape[0]/2, objects.shape[1]/2)
+    central = {label_ids[find_closest_label(centroids, *center) - 1]}
+    row, col = (min(int(c), n - 1) for c, n in zip(center, objects.shape))
+    if objects[row, col] != 0:
+        central.add(objects[row, col])
+    return np.array(sorted(central), dtype=objects.dtype)
+
+def getCenterBoundingBox(objects, pad=0, center=None):
+    """Find the bounding box of the central source(s) of a label map, see `find_central_labels`.
+
+    :param objects: Label map, 0 being the background.
+    :type objects: numpy.ndarray
+    :param pad: No. of pixels added on each side of the bounding box, defaults to 0.
+    :type pad: int, optional
+    :param center: (row, column) reference position, defaults to the center of the image.
+    :type center: tuple, optional
+
+    :return bbox: Row and column slices of the padded bounding box, clipped to the image.
+    :rtype: tuple of slice
+
+    """
+    # From the pixels of the central source(s), as `ndimage.find_objects` would return a slice for every label value.
+    return mask_bounding_box(np.isin(objects, find_central_labels(objects, center=center)), pad=pad)
+
+def label_stack(foreground, npixels, connectivity=8):
+    """Label the connected foreground regions of each image of a stack independently, in a single pass.
+
+    Gives the same label maps as `photutils.segmentation.detect_sources` on each image: regions smaller than `npixels`
+    are removed and the remaining ones are labelled consecutively from 1 in each image.
+
+    :param foreground: Boolean stack of shape (N, H, W), e.g. the pixels above the detection threshold.
+    :type foreground: numpy.ndarray
+    :param npixels: Minimum no. of pixels of a region.
+    :type npixels: int
+    :param connectivity: Either 4 or 8, defaults to 8.
+    :type connectivity: int, optional
+
+    :return labels: Label maps of shape (N, H, W).
+    :rtype: numpy.ndarray
+
+    """
+    from scipy import ndimage
+
+    # A 3D structure without neighbours along the first axis labels each image separately. Labels are assigned in
+    # raster order, so each image gets a contiguous range of labels.
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = ndimage.generate_binary_structure(2, 1 if connectivity == 4 else 2)
+    labels, _ = ndimage.label(foreground, structure=structure)
+    keep = np.bincount(labels.ravel()) >= npixels
+    keep[0] = False
+    new_labels = np.cumsum(keep) * keep  # Consecutive labels over the whole stack, 0 for removed regions.
+    labels = new_labels[labels]
+    # Shift the labels of each image so that they start from 1.
+    last = np.maximum.accumulate(labels.reshape(len(labels), -1).max(axis=1))
+    offsets = np.concatenate(([0], last[:-1]))
+    np.subtract(labels, offsets[:, None, None], out=labels, where=labels > 0)
+    return labels
+
+def mask_bounding_box(mask, pad=0):
+    """Find the bounding box of the nonzero pixels of a mask, e.g. to keep only the crop `mask[bbox]` of a galaxy mask.
+
+    :param mask: Mask.
+    :type mask: numpy.ndarray
+    :param pad: No. of pixels added on each side of the bounding box, defaults to 0.
+    :type pad: int, optional
+
+    :return bbox: Row and column slices of the padded bounding box, clipped to the mask, or None if the mask is empty.
+    :rtype: tuple of slice or None
+
+    """
+    rows, cols = np.flatnonzero(np.any(mask, axis=1)), np.flatnonzero(np.any(mask, axis=0))
+    if len(rows) == 0:
+        return None
+    return (
+        slice(max(rows[0] - pad, 0), min(rows[-1] + 1 + pad, mask.shape[0])),
+        slice(max(cols[0] - pad, 0), min(cols[-1] + 1 + pad, mask.shape[1]))
+    )
+
+def pack_mask(mask):
+    """Pack a 2D mask into bits, 8 pixels per byte along each row, see `numpy.packbits`.
+
+    :param mask: Mask.
+    :type mask: numpy.ndarray
+
+    :return packed: Array of shape (H, ceil(W / 8)) and dtype uint8.
+    :rtype: numpy.ndarray
+
+    """
+    return np.packbits(np.asarray(mask, dtype=bool), axis=-1)
+
+def unpack_mask(packed, width):
+    """Inverse of `pack_mask`.
+
+    :param packed: Packed mask.
+    :type packed: numpy.ndarray
+    :param width: Width W of the mask.
+    :type width: int
+
+    :return mask: Boolean mask.
+    :rtype: numpy.ndarray
+
+    """
+    return np.unpackbits(packed, axis=-1, count=width).view(bool)
+
+def encode_rle(mask):
+    """Run-length encode a mask, flattened in row-major order.
+
+    :param mask: Mask.
+    :type mask: numpy.ndarray
+
+    :return runs: Array of shape (K, 2) holding the start index and length of each run of nonzero pixels.
+    :rtype: numpy.ndarray
+
+    """
+    flat = np.asarray(mask, dtype=bool).ravel()
+    edges = np.diff(np.concatenate(([False], flat, [False])).view(np.int8))
+    starts, stops = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    return np.column_stack((starts, stops - starts))
+
+def decode_rle(runs, shape):
+    """Inverse of `encode_rle`.
+
+    :param runs: Start index and length of each run of nonzero pixels.
+    :type runs: numpy.ndarray
+    :param shape: Shape of the mask.
+    :type shape: tuple
+
+    :return mask: Boolean mask.
+    :rtype: numpy.ndarray
+
+    """
+    runs = np.asarray(runs, dtype=np.intp).reshape(-1, 2)
+    edges = np.zeros(int(np.prod(shape)) + 1, dtype=np.int8)
+    edges[runs[:, 0]] = 1
+    edges[runs[:, 0] + runs[:, 1]] = -1  # Runs are separated by at least one pixel, so they never share an edge.
+    return np.cumsum(edges[:-1], dtype=np.int8).astype(bool).reshape(shape)
+
+def _peak_local_max(image, labels, min_distance, num_peaks, num_peaks_per_label):
+    from skimage.feature import peak_local_max
+
+    return peak_local_max(
+        image, min_distance=min_distance, num_peaks=num_peaks, num_peaks_per_label=num_peaks_per_label, labels=labels
+    )
+
+def _neighbour_offsets(width):
+    return (-width - 1, -width, -width + 1, -1, 1, width - 1, width, width + 1)
+
+def _cap_peaks_per_label(peak_labels, values, num_peaks_per_label):
+    """Positions of the highest `num_peaks_per_label` peaks of each label, labels in increasing order and the peaks of each label by decreasing value, ties in input order."""
+    order = np.lexsort((-values, peak_labels))  # lexsort is stable.
+    sorted_labels = peak_labels[order]
+    group_starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])
+    ranks = np.arange(len(order)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(order)]))
+    return order[ranks < num_peaks_per_label]
+
+def _highest_peaks(flat_labels, flat_values, candidates, shape, num_peaks, num_peaks_per_label, minimum):
+    """Find the `num_peaks` highest peaks by only examining the highest labelled pixels, or return None if they cannot be shown to be the same as those of `peak_local_max`."""
+    n_top = int(max(1024, 64 * num_peaks))
+    if len(candidates) <= n_top:
+        return None
+    candidate_values = flat_values[candidates]
+    partition = np.argpartition(candidate_values, len(candidates) - n_top)
+    top = np.sort(candidates[partition[-n_top:]])  # Raster order.
+    below = candidate_values[partition[:-n_top]].max()  # Highest value of the other pixels.
+
+    top_labels, top_values = flat_labels[top], flat_values[top]
+    exceeded, equalled = np.zeros(len(top), dtype=bool), np.zeros(len(top), dtype=bool)
+    height, width = shape
+    for offset in _neighbour_offsets(width):
+        neighbours = top + offset
+        rows, cols = np.divmod(neighbours, width)
+        same = (flat_labels[neighbours] == top_labels) & (rows > 0) & (rows < height - 1) & (cols > 0) & (cols < width - 1)
+        exceeded |= same & (flat_values[neighbours] > top_values)
+        equalled |= same & (flat_values[neighbours] == top_values)
+    is_peak = ~exceeded & (top_values > minimum)
+    if np.any(is_peak & equalled):  # Plateaus, possibly flat labels which peak_local_max treats specially.
+        return None
+
+    peaks, peak_labels, values = top[is_peak], top_labels[is_peak], top_values[is_peak]
+    kept = np.sort(_cap_peaks_per_label(peak_labels, values, num_peaks_per_label))
+    if len(kept) <= num_peaks:
+        return None
+    selected = kept[np.argsort(-values[kept], kind="stable")[:int(num_peaks)]]
+    # Peaks outside of the examined pixels are lower than all the selected ones, so they cannot change the selection.
+    if values[selected].min() <= below:
+        return None
+    return np.column_stack(np.unravel_index(peaks[selected], shape))
+
+def find_label_peaks(image, labels, min_distance, num_peaks, num_peaks_per_label):
+    """Find the local maxima of each label of a label map.
+
+    Returns the same peaks, in the same order, as `skimage.feature.peak_local_max` with `labels`, but with
+    `min_distance=1` all labels are processed at once with vectorized comparisons of each pixel to its 8 neighbours,
+    instead of one label at a time. When only the `num_peaks` highest peaks of a crowded label map are kept, only the
+    highest labelled pixels are examined. This is much faster for label maps with many labels. Other values of
+    `min_distance`, images containing NaN or infinite values, and labels without any strict local maximum (e.g. flat
+    labels) fall back to `peak_local_max`.
+
+    :param image: Image, e.g. the smoothed galaxy image.
+    :type image: numpy.ndarray
+    :param labels: Label map, 0 being the background.
+    :type labels: numpy.ndarray
+    :param min_distance: Minimum distance between peaks, and width of the image border without peaks.
+    :type min_distance: int
+    :param num_peaks: Maximum no. of peaks.
+    :type num_peaks: int
+    :param num_peaks_per_label: Maximum no. of peaks per label.
+    :type num_peaks_per_label: int
+
+    :return coords: (row, column) coordinates of the peaks.
+    :rtype: numpy.ndarray
+
+    """
+    height, width = image.shape
+    if labels.size and labels.max() > labels.size:
+        # Arrays indexed by label would be as large as the largest label, so sparse labels (e.g. IDs from a catalog)
+        # are made consecutive first. The order of the labels, and so the peaks found, is unchanged.
+        label_ids, inverse = np.unique(labels, return_inverse=True)
+        labels = inverse.reshape(labels.shape) + int(label_ids[0] != 0)
+    if min_distance != 1 or height < 3 or width < 3 or not np.isfinite(image).all():
+        return _peak_local_max(image, labels, min_distance, num_peaks, num_peaks_per_label)
+
+    # Pixels on the image border cannot be peaks, nor neighbours of peaks.
+    flat_labels, flat_values = np.ascontiguousarray(labels).ravel(), np.ascontiguousarray(image).ravel()
+    candidates = np.flatnonzero(flat_labels)
+    rows, cols = np.divmod(candidates, width)
+    candidates = candidates[(rows > 0) & (rows < height - 1) & (cols > 0) & (cols < width - 1)]
+    minimum = image.min()
+    if np.isfinite(num_peaks):
+        coords = _highest_peaks(flat_labels, flat_values, candidates, image.shape, num_peaks, num_peaks_per_label, minimum)
+        if coords is not None:
+            return coords
+
+    inner = labels.copy()
+    inner[[0, -1], :] = 0
+    inner[:, [0, -1]] = 0
+    flat_labels = inner.ravel()
+    peaks, peak_labels, values = candidates, flat_labels[candidates], flat_values[candidates]
+    is_labelled = np.zeros(peak_labels.max(initial=0) + 1, dtype=bool)
+    is_labelled[peak_labels] = True
+    has_non_max = np.zeros_like(is_labelled)
+
+    # Compare the labelled pixels to their 8 neighbours, only keeping those not exceeded by a neighbour of the same
+    # label for the next comparison, so that most pixels are only compared once or twice.
+    for offset in _neighbour_offsets(width):
+        neighbours = peaks + offset
+        exceeded = (flat_labels[neighbours] == peak_labels) & (flat_values[neighbours] > values)
+        has_non_max[peak_labels[exceeded]] = True
+        keep = ~exceeded
+        peaks, peak_labels, values = peaks[keep], peak_labels[keep], values[keep]
+
+    # peak_local_max treats a label whose pixels are all local maxima specially, leave these to it.
+    if np.any(is_labelled & ~has_non_max):
+        return _peak_local_max(image, labels, min_distance, num_peaks, num_peaks_per_label)
+
+    keep = values > minimum
+    peaks, peak_labels, values = peaks[keep], peak_labels[keep], values[keep]
+    order = _cap_peaks_per_label(peak_labels, values, num_peaks_per_label)
+    if len(order) > num_peaks:  # Keep the highest peaks of the whole image, ties in raster order.
+        order = np.sort(order)
+        order = order[np.argsort(-values[order], kind="stable")[:int(num_peaks)]]
+    return np.column_stack(np.unravel_index(peaks[order], image.shape))
+
+def find_farthest_peak_labels(image, labels, center, min_distance, num_peaks, num_peaks_per_label, n_labels=1):
+    """Find the labels whose local maxima are farthest from the center, see `find_label_peaks`.
+
+    With `n_labels=1`, this is the label of the peak selected by `find_farthest_label`.
+
+    :param image: Image, e.g. the smoothed galaxy image.
+    :type image: numpy.ndarray
+    :param labels: Label map, 0 being the background.
+    :type labels: numpy.ndarray
+    :param center: (row, column) reference position.
+    :type center: tuple
+    :param min_distance: Minimum distance between peaks.
+    :type min_distance: int
+    :param num_peaks: Maximum no. of peaks.
+    :type num_peaks: int
+    :param num_peaks_per_label: Maximum no. of peaks per label.
+    :type num_peaks_per_label: int
+    :param n_labels: No. of labels to find, defaults to 1.
+    :type n_labels: int, optional
+
+    :return farthest_labels: Up to `n_labels` distinct labels, farthest first.
+    :rtype: numpy.ndarray
+
+    """
+    local_max = find_label_peaks(image, labels, min_distance, num_peaks, num_peaks_per_label)
+    if len(local_max) == 0:
+        raise ValueError("No local maximum found in the segmentation map.")
+    distances = np.linalg.norm(local_max - np.asarray(center), axis=1)
+    peak_labels = labels[local_max[:, 0], local_max[:, 1]][np.argsort(-distances, kind="stable")]
+    _, first = np.unique(peak_labels, return_index=True)
+    return peak_labels[np.sort(first)][:n_labels]
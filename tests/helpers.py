@@ -0,0 +1,20 @@
+import numpy as np
+
+
+params = dict(npixels=5, nlevels=32, nsigma=3., contrast=0.001, min_distance=1, num_peaks=10, num_peaks_per_label=3, deblend=True)
+
+def make_galaxy(shape=(64, 64), seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    image = 100 * np.exp(-((x - shape[1] / 2) ** 2 + (y - shape[0] / 2) ** 2) / (2 * 4 ** 2))
+    image += 50 * np.exp(-((x - 10) ** 2 + (y - shape[0] + 14) ** 2) / (2 * 2 ** 2))
+    return image + rng.normal(0, 1, shape)
+
+def make_crowded_galaxy():
+    rng = np.random.default_rng(1)
+    y, x = np.mgrid[:256, :256]
+    image = make_galaxy((256, 256))
+    image += 60 * np.exp(-((x - 140) ** 2 + (y - 128) ** 2) / (2 * 2 ** 2))  # Blended with the galaxy.
+    for cx, cy in rng.uniform(20, 236, (30, 2)):
+        image += rng.uniform(10, 80) * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * 2.5 ** 2))
+    return image
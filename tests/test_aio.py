@@ -0,0 +1,77 @@
+import asyncio
+import threading
+import pytest
+import numpy as np
+
+from galmask.aio import AsyncGalMasker, galmask_async
+from galmask.galmask import galmask
+
+from tests.helpers import make_galaxy, params
+
+
+def test_galmask_async_matches_galmask():
+    image = make_galaxy()
+
+    galmasked, mask = asyncio.run(galmask_async(image, **params))
+
+    expected = galmask(image, **params)
+    np.testing.assert_array_equal(mask, expected[1])
+    np.testing.assert_array_equal(galmasked, expected[0])
+
+@pytest.mark.filterwarnings("ignore::photutils.utils.exceptions.NoDetectionsWarning")
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_imap_keeps_order_and_reports_failures(executor):
+    images = [make_galaxy(seed=0), np.random.default_rng(1).normal(size=(64, 64)), make_galaxy(seed=2)]
+
+    async def run():
+        async with AsyncGalMasker(executor=executor, n_jobs=2, max_pending=2, **params) as masker:
+            return [item async for item in masker.imap(images)]
+
+    results = asyncio.run(run())
+
+    assert results[1][0] is None
+    assert "No source detection found in the image!" in str(results[1][1])
+    for index in (0, 2):
+        assert results[index][1] is None
+        np.testing.assert_array_equal(results[index][0][1], galmask(images[index], **params)[1])
+
+def test_concurrent_calls_are_bounded_and_can_time_out():
+    image = make_galaxy()
+
+    async def run():
+        async with AsyncGalMasker(executor="thread", n_jobs=1, max_pending=1, **params) as masker:
+            results = await asyncio.gather(*(masker(image) for _ in range(3)))
+            with pytest.raises(asyncio.TimeoutError):
+                await masker(make_galaxy((1024, 1024)), timeout=1e-3)
+            return results, await masker(image)
+
+    results, last = asyncio.run(run())
+
+    expected = galmask(image, **params)[1]
+    for _, mask in results + [last]:
+        np.testing.assert_array_equal(mask, expected)
+
+def test_timed_out_call_keeps_its_slot_until_done(monkeypatch):
+    release, submitted = threading.Event(), []
+
+    def blocking_galmask_one(masker, image, seg_image, params, pop_profile=False):
+        submitted.append(image)
+        release.wait(10)
+        return (image, image), None, None
+
+    monkeypatch.setattr("galmask.aio.galmask_one", blocking_galmask_one)
+
+    async def run():
+        async with AsyncGalMasker(executor="thread", n_jobs=2, max_pending=1, **params) as masker:
+            with pytest.raises(asyncio.TimeoutError):
+                await masker(np.zeros(1), timeout=0.05)
+            second = asyncio.ensure_future(masker(np.ones(1)))
+            await asyncio.sleep(0.1)
+            assert len(submitted) == 1 and not second.done()  # Waits for the slot of the still running first image.
+            release.set()
+            return await second
+
+    galmasked, _ = asyncio.run(run())
+
+    assert len(submitted) == 2
+    np.testing.assert_array_equal(galmasked, np.ones(1))
@@ -0,0 +1,54 @@
+import pytest
+import numpy as np
+
+from photutils.background import MedianBackground
+from photutils.datasets import make_100gaussians_image
+from photutils.segmentation import detect_threshold
+
+from galmask.background import estimate_background, estimate_background_rms, estimate_background_stack
+from galmask.galmask import galmask
+
+from tests.helpers import make_galaxy, params
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+def test_global_background_matches_photutils():
+    image = make_100gaussians_image()
+    background, background_rms = estimate_background(image)
+
+    expected_background = MedianBackground().calc_background(image)
+    expected_threshold = detect_threshold(image - expected_background, 3.0, background=0.0)
+    assert np.isclose(background, expected_background)
+    np.testing.assert_allclose(3.0 * background_rms, expected_threshold)
+    assert np.isclose(estimate_background_rms(image - background), background_rms)
+
+def test_background_maps():
+    image = make_100gaussians_image()
+    background, background_rms = estimate_background(image, box_size=50)
+
+    assert background.shape == background_rms.shape == image.shape
+    assert np.all(background_rms > 0)
+
+def test_galmask_with_precomputed_background():
+    image = make_galaxy() + 10.0
+    background, background_rms = estimate_background(image)
+    expected = galmask(image, **params)
+
+    for kwargs in ({"background": background, "background_rms": background_rms}, {"background": background}, {"background_rms": background_rms}):
+        galmasked, mask = galmask(image, **params, **kwargs)
+        np.testing.assert_array_equal(mask, expected[1])
+        np.testing.assert_array_equal(galmasked, expected[0])
+
+    maps = estimate_background(image, box_size=16)
+    np.testing.assert_array_equal(
+        galmask(image, background_box_size=16, **params)[1], galmask(image, background=maps[0], background_rms=maps[1], **params)[1]
+    )
+
+def test_stack_background_matches_per_image():
+    stack = np.stack([make_galaxy(seed=seed) + seed for seed in range(3)])
+
+    background, background_rms = estimate_background_stack(stack)
+
+    expected = np.array([estimate_background(image) for image in stack])
+    np.testing.assert_allclose(background, expected[:, 0], rtol=1e-12)
+    np.testing.assert_allclose(background_rms, expected[:, 1], rtol=1e-12)
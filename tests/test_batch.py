@@ -0,0 +1,75 @@
+import pytest
+import numpy as np
+from photutils.segmentation import detect_sources
+
+from galmask.batch import galmask_batch, galmask_imap, imap_bounded
+from galmask.galmask import galmask
+
+from tests.helpers import make_galaxy, params
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+@pytest.mark.filterwarnings("ignore::photutils.utils.exceptions.NoDetectionsWarning")
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_batch_keeps_order_and_reports_failures(executor):
+    images = [make_galaxy(seed=0), np.random.default_rng(1).normal(size=(64, 64)), make_galaxy(seed=2)]
+
+    results, failures = galmask_batch(images, n_jobs=2, executor=executor, **params)
+
+    assert len(results) == 3
+    assert list(failures) == [1]
+    assert "No source detection found in the image!" in str(failures[1])
+    assert results[1] is None
+    for index in (0, 2):
+        galmasked, mask = galmask(images[index], **params)
+        np.testing.assert_array_equal(results[index][1], mask)
+        np.testing.assert_array_equal(results[index][0], galmasked)
+
+def test_batch_accepts_stack_and_per_image_params():
+    stack = np.stack([make_galaxy(seed=seed) for seed in range(3)])
+    per_image = [{"mode": "1"}, {"mode": "2"}, {"mode": "1", "remove_local_max": False}]
+
+    results, failures = galmask_batch(iter(stack), params=per_image, n_jobs=1, **params)
+
+    assert not failures
+    for image, image_params, (galmasked, mask) in zip(stack, per_image, results):
+        np.testing.assert_array_equal(mask, galmask(image, **{**params, **image_params})[1])
+
+def test_imap_rejects_mismatched_inputs():
+    with pytest.raises(ValueError):
+        list(galmask_imap(np.zeros((64, 64)), n_jobs=1, **params))
+    with pytest.raises(ValueError):
+        list(galmask_imap([make_galaxy()], seg_images=[], n_jobs=1, **params))
+
+def test_serial_stack_matches_per_image_calls():
+    stack = np.stack([make_galaxy(seed=seed) for seed in range(3)])
+    seg_images = [None, detect_sources(stack[1], 5.0, npixels=5).data, None]
+
+    results, failures = galmask_batch(stack, seg_images=seg_images, n_jobs=1, **params)
+
+    assert not failures
+    for image, seg_image, (galmasked, mask) in zip(stack, seg_images, results):
+        expected = galmask(image, seg_image=seg_image, **params)
+        np.testing.assert_array_equal(mask, expected[1])
+        np.testing.assert_array_equal(galmasked, expected[0])
+
+def add(masker, x, y):
+    return x + y + (masker or 0)
+
+def test_imap_bounded_reads_tasks_as_results_are_consumed():
+    read = []
+
+    def tasks():
+        for i in range(10):
+            read.append(i)
+            yield i, (i, 1)
+
+    results = imap_bounded(add, tasks(), 100, n_jobs=2, executor="thread", max_pending=3)
+
+    assert next(results) == (0, 101)
+    assert len(read) == 3  # Only max_pending tasks are submitted ahead of the results.
+    results.close()  # Stopping early cancels the pending tasks and shuts the pool down.
+    assert len(read) == 3
+    assert list(imap_bounded(add, ((i, (i, 1)) for i in range(10)), None, n_jobs=2, executor="process")) == [
+        (i, i + 1) for i in range(10)
+    ]
@@ -0,0 +1,81 @@
+import os
+import numpy as np
+
+from galmask.batch import galmask_batch
+from galmask.cache import ResultCache, cache_key
+from galmask.galmask import GalMasker, galmask
+from galmask.profiling import StageProfiler
+
+from tests.helpers import make_galaxy, params
+
+
+def test_cache_key_depends_on_content_and_parameters():
+    image = make_galaxy()
+
+    key = cache_key(image, None, npixels=5, mode="1")
+
+    assert cache_key(np.asfortranarray(image), None, mode="1", npixels=np.int64(5)) == key
+    assert cache_key(image + 1e-9, None, npixels=5, mode="1") != key
+    assert cache_key(image.astype(np.float32), None, npixels=5, mode="1") != key
+    assert cache_key(image, image, npixels=5, mode="1") != key
+    assert cache_key(image, None, npixels=5, mode="2") != key
+
+def test_cached_results_are_returned_without_recomputing():
+    image = make_galaxy()
+    profiler = StageProfiler()
+    masker = GalMasker(**params, cache=ResultCache(), profiler=profiler)
+
+    first = masker(image)
+    first[0][:] = 0  # Returned results are copies, modifying them does not affect the cache.
+    second = masker(image)
+
+    expected = galmask(image, **params)
+    for result in (second, masker(image)):
+        np.testing.assert_array_equal(result[0], expected[0])
+        np.testing.assert_array_equal(result[1], expected[1])
+    assert {row["stage"]: row["count"] for row in profiler.summary()}["detect"] == 1
+    assert GalMasker(**{**params, "mode": "2"}).cache_key(image) != masker.cache_key(image)
+
+def test_disk_tier_is_shared_and_bounded(tmp_path):
+    images = [make_galaxy(seed=seed) for seed in range(3)]
+    cache = ResultCache(maxsize=0, directory=str(tmp_path))
+    for image in images:
+        galmask(image, cache=cache, **params)
+    sizes = [os.path.getsize(path) for path in tmp_path.iterdir()]
+    assert len(sizes) == 3
+
+    other = ResultCache(directory=str(tmp_path), max_bytes=max(sizes) + 1)
+    key = GalMasker(**params).cache_key(images[0])
+    np.testing.assert_array_equal(other.get(key)[1], galmask(images[0], **params)[1])
+    other.put("new", galmask(images[1], **params))
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+    assert other.get("new") is not None
+
+    other.clear()
+    assert other.get("new") is None and not list(tmp_path.glob("*.npz"))
+
+def test_disk_tier_is_only_listed_when_full(tmp_path, monkeypatch):
+    result = galmask(make_galaxy(), **params)
+    cache = ResultCache(maxsize=0, directory=str(tmp_path))
+    cache.put("first", result)
+    size = os.path.getsize(tmp_path / "first.npz")
+    cache = ResultCache(maxsize=0, directory=str(tmp_path), max_bytes=3 * size)
+    listings = []
+    evict = cache._evict
+    monkeypatch.setattr(cache, "_evict", lambda **kwargs: listings.append(None) or evict(**kwargs))
+
+    for key in "abcd":
+        cache.put(key, result)
+
+    assert len(listings) == 2  # On the first write, to find the size of the disk tier, and when it is full.
+    assert sorted(path.stem for path in tmp_path.glob("*.npz")) == ["b", "c", "d"]
+
+def test_batch_of_stacked_images_is_cached():
+    images = np.stack([make_galaxy(seed=seed) for seed in range(3)])
+    cache = ResultCache()
+
+    results, failures = galmask_batch(images, n_jobs=1, cache=cache, **params)
+
+    assert failures == {} and len(cache._memory) == 3
+    for image, (galmasked, mask) in zip(images, results):
+        np.testing.assert_array_equal(cache.get(GalMasker(**params).cache_key(image))[1], mask)
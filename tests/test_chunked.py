@@ -0,0 +1,62 @@
+import pytest
+import numpy as np
+
+from galmask.chunked import galmask_chunked, open_array
+from galmask.galmask import GalMasker
+
+from tests.helpers import make_galaxy, params
+
+
+def make_archive(path, n_images=7):
+    images = open_array(str(path), mode="w", shape=(n_images, 64, 64), dtype=float)
+    for i in range(n_images):
+        images[i] = make_galaxy(seed=i)
+    images[3] = np.random.default_rng(3).normal(0, 1, (64, 64))  # No source.
+    images.flush()
+    return np.load(path)
+
+@pytest.mark.filterwarnings("ignore::photutils.utils.exceptions.NoDetectionsWarning")
+@pytest.mark.parametrize("n_jobs, executor", [(1, "process"), (2, "thread"), (2, "process")])
+def test_chunked_matches_per_image_masks(tmp_path, n_jobs, executor):
+    images = make_archive(tmp_path / "images.npy")
+
+    masks, failures = galmask_chunked(
+        str(tmp_path / "images.npy"), str(tmp_path / "masks.npy"), chunk_size=3, n_jobs=n_jobs, executor=executor,
+        max_pending=1, **params
+    )
+
+    assert list(failures) == [3]
+    assert masks.dtype == bool and masks.shape == images.shape
+    masker = GalMasker(**params)
+    for i, image in enumerate(images):
+        expected = np.zeros(image.shape, dtype=bool) if i == 3 else masker.mask(image).astype(bool)
+        np.testing.assert_array_equal(masks[i], expected)
+    np.testing.assert_array_equal(np.load(tmp_path / "masks.npy"), masks)
+
+    with pytest.raises(FileExistsError):
+        galmask_chunked(str(tmp_path / "images.npy"), str(tmp_path / "masks.npy"), n_jobs=1, **params)
+
+def test_chunked_writes_into_array_with_seg_images():
+    images = np.stack([make_galaxy(seed=seed) for seed in range(4)])
+    masker = GalMasker(**params)
+    seg_images = np.stack([masker.detect(masker.smooth(image, 0.0)[1], 1.0) for image in images])
+    output = np.ones(images.shape, dtype=np.uint8)
+
+    result, failures = galmask_chunked(images, output, seg_images=seg_images, n_jobs=1, **params)
+
+    assert result is output and failures == {}
+    for image, seg_image, mask in zip(images, seg_images, output):
+        np.testing.assert_array_equal(mask, masker.mask(image, seg_image=seg_image))
+    with pytest.raises(ValueError):
+        galmask_chunked(images, output[:2], n_jobs=1, **params)
+
+def test_chunked_zarr_store(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    images = np.stack([make_galaxy(seed=seed) for seed in range(5)])
+    store = zarr.open_array(str(tmp_path / "images.zarr"), mode="w", shape=images.shape, chunks=(2, 64, 64), dtype=float)
+    store[:] = images
+
+    masks, failures = galmask_chunked(str(tmp_path / "images.zarr"), str(tmp_path / "masks.zarr"), n_jobs=2, executor="thread", **params)
+
+    assert failures == {} and masks.chunks == (2, 64, 64)
+    np.testing.assert_array_equal(masks[:], GalMasker(**params).mask_stack(images)[1].astype(bool))
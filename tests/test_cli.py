@@ -0,0 +1,73 @@
+import os
+import json
+import pytest
+import numpy as np
+from astropy.io import fits
+
+from galmask.cli import load_params, main
+
+from tests.helpers import make_galaxy, params
+
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+@pytest.mark.filterwarnings("ignore::photutils.utils.exceptions.NoDetectionsWarning")
+def test_cli_resumes_from_manifest(tmp_path, capsys):
+    for i, image in enumerate([make_galaxy(seed=0), np.random.default_rng(1).normal(size=(64, 64)), make_galaxy(seed=2)]):
+        fits.writeto(tmp_path / f"gal{i}.fits", image)
+    param_file = tmp_path / "params.json"
+    param_file.write_text(json.dumps({**params, "mode": "2"}))
+    output = tmp_path / "out"
+
+    # First run processes only gal0 and gal1, as if it had been killed before reaching gal2.
+    argv = ["-p", str(param_file), "-o", str(output), "-s", "nsigma=3"]
+    assert main([str(tmp_path / "gal[01].fits")] + argv) == 1
+    assert sorted(os.listdir(output)) == ["gal0_galmask.fits", "manifest.jsonl"]
+
+    assert main([str(tmp_path / "gal*.fits")] + argv + ["--jobs", "2", "--executor", "thread"]) == 0
+    assert "2 of 3 inputs already processed" in capsys.readouterr().err
+    assert sorted(os.listdir(output)) == ["gal0_galmask.fits", "gal2_galmask.fits", "manifest.jsonl"]
+    with open(output / "manifest.jsonl") as f:
+        records = [json.loads(line) for line in f]
+    assert [(os.path.basename(r["input"]), r["status"]) for r in records] == [("gal0.fits", "ok"), ("gal1.fits", "failed"), ("gal2.fits", "ok")]
+
+    assert main([str(tmp_path / "gal*.fits")] + argv + ["--retry-failed"]) == 1
+    assert "2 of 3 inputs already processed" in capsys.readouterr().err
+
+def test_cli_rejects_inputs_with_the_same_output(tmp_path, capsys):
+    for directory in ("a", "b"):
+        (tmp_path / directory).mkdir()
+        fits.writeto(tmp_path / directory / "gal.fits", make_galaxy())
+    param_file = tmp_path / "params.json"
+    param_file.write_text(json.dumps(params))
+
+    with pytest.raises(SystemExit) as exc_info:
+        main([str(tmp_path / "*" / "gal.fits"), "-p", str(param_file), "-o", str(tmp_path / "out")])
+    assert exc_info.value.code == 2 and "gal_galmask.fits" in capsys.readouterr().err
+    assert not (tmp_path / "out").exists()
+
+@pytest.mark.parametrize("argv, message", [
+    (["gal.fits", "-s", "npixels=5"], "Missing galmask parameters"),
+    (["gal.fits", "-p", "missing.json"], "missing.json"),
+    (["gal.fits", "-p", "params.json", "-s", "nsigma"], "KEY=VALUE"),
+    (["nothing*.fits", "-p", "params.json"], "No input file matches"),
+])
+def test_cli_reports_user_errors_without_traceback(tmp_path, capsys, monkeypatch, argv, message):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "params.json").write_text(json.dumps(params))
+    fits.writeto(tmp_path / "gal.fits", make_galaxy())
+
+    with pytest.raises(SystemExit) as exc_info:
+        main(argv + ["-o", "out"])
+
+    assert exc_info.value.code == 2 and message in capsys.readouterr().err
+
+def test_load_params_overrides_and_missing(tmp_path):
+    param_file = tmp_path / "params.json"
+    param_file.write_text(json.dumps(params))
+
+    loaded = load_params(str(param_file), ["mode=0", "nsigma=2.5", "deblend=false"])
+    assert loaded["mode"] == "0"
+    assert loaded["nsigma"] == 2.5 and loaded["deblend"] is False
+
+    with pytest.raises(ValueError):
+        load_params(None, ["npixels=5"])
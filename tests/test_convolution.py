@@ -0,0 +1,74 @@
+import os
+import pytest
+import numpy as np
+from astropy.io import fits
+from astropy.convolution import convolve, Gaussian2DKernel
+
+from galmask.convolution import CONVOLVE_RTOL, Convolver, convolve_image, separable_factors
+from galmask.galmask import galmask
+
+from tests.helpers import make_galaxy, params
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.mark.parametrize("shape", [(64, 64), (101, 57)])
+@pytest.mark.parametrize("method", ["fft", "opencv", "auto"])
+def test_methods_match_direct_convolution(shape, method):
+    image = np.random.default_rng(0).normal(size=shape) * 100
+    kernel = fits.getdata(os.path.join(current_dir, "../example/kernel.fits"))
+
+    expected = convolve(image, kernel, normalize_kernel=True)
+    np.testing.assert_allclose(convolve_image(image, kernel, method=method), expected, rtol=0, atol=CONVOLVE_RTOL * np.abs(image).max())
+
+def test_separable_method_matches_direct_convolution():
+    image = np.random.default_rng(0).normal(size=(80, 70))
+    kernel = Gaussian2DKernel(1.5, x_size=7, y_size=7).array
+
+    assert separable_factors(kernel) is not None
+    np.testing.assert_allclose(convolve_image(image, kernel, method="separable"), convolve(image, kernel), rtol=0, atol=CONVOLVE_RTOL * np.abs(image).max())
+    with pytest.raises(ValueError):
+        convolve_image(image, np.random.default_rng(1).random((5, 5)), method="separable")
+
+def test_invalid_inputs_raise_error():
+    image = np.random.default_rng(0).normal(size=(32, 32))
+    image[3, 3] = np.nan
+    kernel = Gaussian2DKernel(1, x_size=3, y_size=3).array
+
+    np.testing.assert_array_equal(convolve_image(image, kernel), convolve(image, kernel))  # NaNs fall back to astropy.
+    with pytest.raises(ValueError):
+        convolve_image(image, kernel, method="fft")
+    with pytest.raises(ValueError):
+        convolve_image(image, np.ones((4, 4)))
+    with pytest.raises(ValueError):
+        convolve_image(image, kernel, method="spline")
+
+def test_galmask_masks_do_not_depend_on_convolution_method():
+    image = make_galaxy()
+    expected = galmask(image, convolve_method="direct", **params)[1]
+    for method in ("fft", "separable", "opencv", "auto"):
+        np.testing.assert_array_equal(galmask(image, convolve_method=method, **params)[1], expected)
+
+def test_convolver_caches_kernel_fft_per_shape():
+    kernel = Gaussian2DKernel(1.5, x_size=7, y_size=7).array
+    convolver = Convolver(kernel, method="fft", cache_size=2)
+
+    first = convolver.kernel_fft((64, 64))
+    assert convolver.kernel_fft((64, 64)) is first
+    convolver.kernel_fft((32, 32))
+    convolver.kernel_fft((48, 48))  # Evicts the least recently used (64, 64) FFT.
+    assert convolver.kernel_fft((64, 64)) is not first
+
+    image = np.random.default_rng(0).normal(size=(64, 64))
+    np.testing.assert_allclose(convolver(image), convolve(image, kernel), rtol=0, atol=CONVOLVE_RTOL * np.abs(image).max())
+
+@pytest.mark.parametrize("method", ["direct", "fft", "separable", "opencv", "auto"])
+def test_stack_convolution_matches_per_image(method):
+    stack = np.random.default_rng(0).normal(size=(3, 40, 50)) * 100
+    convolver = Convolver(Gaussian2DKernel(1, x_size=5, y_size=5).array, method=method)
+
+    convolved = convolver(stack)
+
+    assert convolved.shape == stack.shape
+    for image, expected in zip(stack, convolved):
+        np.testing.assert_allclose(expected, convolver(image), rtol=0, atol=CONVOLVE_RTOL * np.abs(stack).max())
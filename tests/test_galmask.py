@@ -1,10 +1,15 @@
+import sys
+import subprocess
+import pickle
 import pytest
 import numpy as np
 from astropy.convolution import Gaussian2DKernel
 
 from photutils.datasets import make_100gaussians_image
 
-from galmask.galmask import galmask
+from galmask.galmask import galmask, galmask_multiband, GalMasker
+
+from tests.helpers import make_crowded_galaxy, make_galaxy, params
 
 
 @pytest.mark.filterwarnings("ignore::UserWarning")
@@ -48,4 +53,247 @@ def test_kernel_not_normalized_raises_warning():
         galmask(
             image, npixels, nlevels, nsigma, contrast, min_distance,
             num_peaks, num_peaks_per_label, kernel=kernel
-        )
\ No newline at end of file
+        )
+
+def test_galmasker_matches_galmask_and_can_be_pickled():
+    masker = GalMasker(convolve_method="fft", **params)
+    for seed in range(3):
+        image = make_galaxy(seed=seed)
+        expected_galmasked, expected_mask = galmask(image, convolve_method="fft", **params)
+        galmasked, mask = masker(image)
+        np.testing.assert_array_equal(mask, expected_mask)
+        np.testing.assert_array_equal(galmasked, expected_galmasked)
+
+    np.testing.assert_array_equal(pickle.loads(pickle.dumps(masker))(image)[1], expected_mask)
+
+@pytest.mark.parametrize("mode", ["0", "1", "2"])
+def test_more_than_255_labels_are_not_truncated(mode):
+    # 400 small sources on a grid, the central one being label 256, which wraps around to 0 when cast to uint8.
+    labels = np.random.default_rng(0).permutation(np.arange(1, 401)).reshape(20, 20)
+    labels[labels == 256], labels[10, 10] = labels[10, 10], 256
+    seg_image = np.zeros((200, 200), dtype=np.int32)
+    for (i, j), label in np.ndenumerate(labels):
+        seg_image[10 * i + 2:10 * i + 6, 10 * j + 2:10 * j + 6] = label
+    image = (seg_image > 0).astype(float)
+    seg_image_copy = seg_image.copy()
+
+    galmasked, mask = galmask(
+        image, 5, 32, 3., 0.001, 1, 10, 3, seg_image=seg_image, mode=mode, remove_local_max=False
+    )
+
+    np.testing.assert_array_equal(mask, (seg_image == 256).astype(float))
+    np.testing.assert_array_equal(seg_image, seg_image_copy)  # Input segmentation map is left untouched.
+
+def test_segmentation_map_is_not_modified_by_local_max_removal():
+    image = make_galaxy()
+    seg_image = np.zeros((64, 64), dtype=np.int32)
+    seg_image[26:38, 26:38] = 1
+    seg_image[45:56, 5:15] = 2
+    seg_image_copy = seg_image.copy()
+
+    galmasked, mask = galmask(image, seg_image=seg_image, **{**params, "deblend": False})
+
+    np.testing.assert_array_equal(mask, (seg_image_copy == 1).astype(float))
+    np.testing.assert_array_equal(seg_image, seg_image_copy)
+
+@pytest.mark.parametrize("mode", ["1", "2"])
+def test_roi_matches_full_frame(mode):
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[:256, :256]
+    image = make_galaxy((256, 256))
+    image += 60 * np.exp(-((x - 140) ** 2 + (y - 131) ** 2) / (2 * 2 ** 2))  # Close companion, kept in the ROI.
+    for cx, cy in rng.uniform(20, 236, (20, 2)):
+        image += rng.uniform(10, 80) * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * 2.5 ** 2))
+
+    expected = galmask(image, mode=mode, **params)[1]
+    galmasked, mask = galmask(image, mode=mode, roi_pad=10, **params)
+
+    assert mask.shape == image.shape
+    np.testing.assert_array_equal(mask, expected)
+    np.testing.assert_array_equal(galmasked, mask * image)
+
+def test_import_does_not_load_heavy_dependencies():
+    code = (
+        "import sys, galmask.galmask, galmask.batch, galmask.cli; "
+        "print(','.join(m for m in ('cv2', 'skimage', 'astropy', 'photutils', 'scipy') if m in sys.modules))"
+    )
+    loaded = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip()
+    assert loaded == ""
+
+@pytest.mark.parametrize("mode, kernel, imports_cv2", [
+    ("0", "None", False), ("2", "None", False), ("1", "None", True),
+    ("2", "np.array([[1., 2., 1.], [2., 8., 2.], [1., 2., 1.]])", True)  # Not separable.
+])
+def test_opencv_is_only_imported_when_needed(mode, kernel, imports_cv2):
+    # With the default separable kernel, "auto" convolution does not need cv2, only the connected components of mode "1" do.
+    code = (
+        "import sys, numpy as np; from galmask.galmask import galmask; from tests.helpers import make_galaxy, params; "
+        f"galmask(make_galaxy(), mode={mode!r}, kernel={kernel}, **params); print('cv2' in sys.modules)"
+    )
+    loaded = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip()
+    assert loaded == str(imports_cv2)
+
+@pytest.mark.parametrize("mode", ["0", "1", "2"])
+def test_multiband_applies_detection_mask_to_all_bands(mode):
+    image = make_galaxy()
+    bands = np.stack([image, 2 * image + 1, 0.5 * image])
+
+    galmasked, mask = galmask_multiband(bands, mode=mode, **params)
+
+    expected = galmask(bands.sum(axis=0), mode=mode, **params)[1]
+    np.testing.assert_array_equal(mask, expected)
+    assert galmasked.shape == bands.shape
+    np.testing.assert_array_equal(galmasked, mask * bands)
+
+def test_multiband_with_detection_image():
+    image = make_galaxy()
+    bands = [image + 1, image - 1]
+
+    galmasked, mask = GalMasker(**params).mask_bands(bands, detection_image=image)
+
+    np.testing.assert_array_equal(mask, galmask(image, **params)[1])
+    np.testing.assert_array_equal(galmasked[1], mask * bands[1])
+
+    with pytest.raises(ValueError):
+        galmask_multiband(bands, detection_image=image[:32], **params)
+
+@pytest.mark.filterwarnings("ignore::photutils.utils.exceptions.NoDetectionsWarning")
+@pytest.mark.parametrize("mode", ["0", "1", "2"])
+@pytest.mark.parametrize("deblend", [False, True])
+def test_stack_matches_per_image_calls(mode, deblend):
+    stack = np.stack([make_galaxy(seed=seed) for seed in range(4)] + [np.random.default_rng(9).normal(size=(64, 64))])
+    masker = GalMasker(**{**params, "deblend": deblend}, mode=mode)
+
+    results = list(masker.iter_stack(stack))
+
+    for image, (mask, error) in zip(stack[:4], results):
+        assert error is None
+        np.testing.assert_array_equal(mask, masker(image)[1])
+    assert results[4][0] is None
+    assert "No source detection found in the image!" in str(results[4][1])
+
+    galmasked, masks = masker.mask_stack(stack[:4])
+    np.testing.assert_array_equal(masks, [result[0] for result in results[:4]])
+    np.testing.assert_array_equal(galmasked, masks * stack[:4])
+    with pytest.raises(ValueError):
+        masker.mask_stack(stack)
+
+class ReadRecordingStack(np.ndarray):
+    """Stack recording the slices read from it, as from a memory-mapped file."""
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            self.reads.append((key.start, key.stop))
+        return super().__getitem__(key)
+
+def test_stack_is_read_chunk_by_chunk():
+    stack = np.stack([make_galaxy(seed=seed) for seed in range(5)])
+    masker = GalMasker(**params)
+    expected = list(masker.iter_stack(stack))
+    recording = stack.view(ReadRecordingStack)
+    recording.reads = []
+
+    results = masker.iter_stack(recording, chunk_size=2)
+
+    next(results)
+    assert recording.reads == [(0, 2)]
+    for (mask, error), (expected_mask, _) in zip([next(results)] + list(results), expected[1:]):
+        assert error is None
+        np.testing.assert_array_equal(mask, expected_mask)
+    assert recording.reads == [(0, 2), (2, 4), (4, 6)]
+
+def test_boolean_mask_and_in_place_application():
+    image = make_galaxy()
+    expected_galmasked, expected_mask = galmask(image, **params)
+
+    galmasked, mask = galmask(image, mask_dtype=bool, **params)
+    assert mask.dtype == bool
+    np.testing.assert_array_equal(mask, expected_mask)
+    np.testing.assert_array_equal(galmasked, expected_galmasked)
+
+    out = np.empty_like(image)
+    assert galmask(image, out=out, **params)[0] is out
+    np.testing.assert_array_equal(out, expected_galmasked)
+
+    galmasked, _ = GalMasker(**params)(image, out=image)
+    assert galmasked is image
+    np.testing.assert_array_equal(image, expected_galmasked)
+
+def test_remove_several_local_max_labels():
+    image = make_galaxy()
+    y, x = np.mgrid[:64, :64]
+    image += 50 * np.exp(-((x - 54) ** 2 + (y - 54) ** 2) / (2 * 2 ** 2))  # Second companion, farther away.
+    masker = GalMasker(**{**params, "deblend": False}, mode="2")
+    objects = masker.detect(masker.smooth(image, 0.0)[1], 1.0)
+
+    one, two = (GalMasker(**{**params, "deblend": False}, mode="2", remove_local_max=k)(image)[1] for k in (1, 2))
+
+    np.testing.assert_array_equal(one, two)  # Removing far away labels never changes the central galaxy...
+    with pytest.raises(ValueError):  # ...unless no label is left.
+        GalMasker(**{**params, "deblend": False}, mode="2", remove_local_max=len(np.unique(objects)) - 1)(image)
+
+@pytest.mark.parametrize("mode", ["1", "2"])
+@pytest.mark.parametrize("remove_local_max", [False, True])
+def test_central_deblending_matches_full_deblending(mode, remove_local_max):
+    image = make_crowded_galaxy()
+    full, central = (
+        GalMasker(**{**params, "deblend": deblend}, mode=mode, remove_local_max=remove_local_max) for deblend in (True, "central")
+    )
+
+    np.testing.assert_array_equal(central(image)[1], full(image)[1])
+    np.testing.assert_array_equal(central.mask(image, center=(120, 140)), full.mask(image, center=(120, 140)))
+
+@pytest.mark.parametrize("mode", ["1", "2"])
+def test_central_deblending_of_small_integer_segmentation_map(mode):
+    image = make_crowded_galaxy()
+    masker = GalMasker(**{**params, "deblend": "central"}, mode=mode)
+    objects = masker.detect(masker.smooth(image, 0.0)[1], 1.0)
+    objects = np.where(objects > 0, objects + 255 - objects.max(), 0)  # Labels up to 255, new pieces need larger ones.
+
+    mask = masker.mask(image, seg_image=objects.astype(np.uint8))
+
+    np.testing.assert_array_equal(mask, masker.mask(image, seg_image=objects.astype(np.int32)))
+    np.testing.assert_array_equal(mask, GalMasker(**params, mode=mode).mask(image, seg_image=objects.astype(np.int32)))
+
+@pytest.mark.parametrize("mode", ["1", "2"])
+def test_full_deblending_of_small_integer_segmentation_map(mode):
+    image = make_crowded_galaxy()
+    masker = GalMasker(**{**params, "deblend": True}, mode=mode)
+    objects = masker.detect(masker.smooth(image, 0.0)[1], 1.0)
+    objects = np.where(objects > 0, objects + 255 - objects.max(), 0)  # Labels up to 255, new pieces need larger ones.
+
+    mask = masker.mask(image, seg_image=objects.astype(np.uint8))
+
+    np.testing.assert_array_equal(mask, masker.mask(image, seg_image=objects.astype(np.int32)))
+    assert masker.detect(None, None, seg_image=objects.astype(np.uint8)).dtype == np.int32
+
+@pytest.mark.parametrize("mode", ["1", "2"])
+def test_local_max_removal_with_sparse_label_ids(mode):
+    image = make_crowded_galaxy()
+    masker = GalMasker(**{**params, "deblend": False}, mode=mode)
+    objects = masker.detect(masker.smooth(image, 0.0)[1], 1.0).astype(np.int64)
+
+    mask = masker.mask(image, seg_image=objects * 10**12)  # E.g. catalog IDs.
+
+    np.testing.assert_array_equal(mask, masker.mask(image, seg_image=objects))
+
+@pytest.mark.parametrize("kwargs", [dict(roi_pad=5), dict(deblend="central"), dict(deblend="central", nlevels="auto")])
+def test_central_source_with_sparse_label_ids(kwargs):
+    image = make_crowded_galaxy()
+    masker = GalMasker(**{**params, "deblend": False, **kwargs}, mode="2")
+    objects = masker.detect(masker.smooth(image, 0.0)[1], 1.0).astype(np.int64)
+
+    mask = masker.mask(image, seg_image=objects * 10**12)  # E.g. catalog IDs.
+
+    np.testing.assert_array_equal(mask, masker.mask(image, seg_image=objects))
+
+@pytest.mark.parametrize("deblend", [True, "central"])
+def test_auto_nlevels(deblend):
+    image = make_crowded_galaxy()
+    masker = GalMasker(**{**params, "nlevels": "auto", "deblend": deblend}, mode="2")
+
+    mask = masker(image)[1]
+
+    np.testing.assert_array_equal(mask, galmask(image, mode="2", **params)[1])
+    assert GalMasker(**{**params, "nlevels": "auto", "deblend": False}, mode="2")(image)[1].sum() > mask.sum()
+    with pytest.raises(ValueError):
+        GalMasker(**{**params, "deblend": "all"})
@@ -0,0 +1,62 @@
+import os
+import pytest
+import numpy as np
+from astropy.io import fits
+
+from galmask.galmask import galmask
+from galmask.io import iter_fits_images, stream_galmask
+
+from tests.helpers import make_galaxy, params
+
+
+@pytest.fixture
+def fits_dir(tmp_path):
+    images = [make_galaxy(seed=0), np.random.default_rng(1).normal(size=(64, 64)), make_galaxy(seed=2)]
+    for i, image in enumerate(images):
+        header = fits.Header({"OBJECT": f"gal{i}"})
+        fits.PrimaryHDU(image, header=header).writeto(tmp_path / f"gal{i}.fits")
+    return tmp_path, images
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+@pytest.mark.filterwarnings("ignore::photutils.utils.exceptions.NoDetectionsWarning")
+def test_stream_directory_to_directory(fits_dir, tmp_path_factory):
+    path, images = fits_dir
+    output = str(tmp_path_factory.mktemp("out"))
+
+    streamed = list(stream_galmask(str(path), output=output, **params))
+
+    assert [name for name, _, _ in streamed] == ["gal0", "gal1", "gal2"]
+    assert streamed[1][1] is None and isinstance(streamed[1][2], ValueError)
+    assert sorted(os.listdir(output)) == ["gal0_galmask.fits", "gal2_galmask.fits"]
+    with fits.open(os.path.join(output, "gal2_galmask.fits")) as hdul:
+        galmasked, mask = galmask(images[2], **params)
+        np.testing.assert_allclose(hdul[0].data, galmasked)
+        np.testing.assert_array_equal(hdul["MASK"].data, mask)
+        assert hdul[0].header["OBJECT"] == "gal2"
+
+@pytest.mark.filterwarnings("ignore::UserWarning")
+@pytest.mark.filterwarnings("ignore::photutils.utils.exceptions.NoDetectionsWarning")
+def test_stream_multi_extension_file(fits_dir, tmp_path):
+    _, images = fits_dir
+    mef = str(tmp_path / "cutouts.fits")
+    fits.HDUList([fits.PrimaryHDU()] + [fits.ImageHDU(image) for image in images]).writeto(mef)
+    output = str(tmp_path / "masked.fits")
+
+    names = [name for name, _, _ in stream_galmask(mef, output=output, n_jobs=2, executor="thread", **params)]
+
+    assert names == ["cutouts_1", "cutouts_2", "cutouts_3"]
+    with fits.open(output) as hdul:
+        assert [hdu.name for hdu in hdul[1:]] == ["CUTOUTS_1", "CUTOUTS_1_MASK", "CUTOUTS_3", "CUTOUTS_3_MASK"]
+        np.testing.assert_array_equal(hdul["CUTOUTS_3_MASK"].data, galmask(images[2], **params)[1])
+
+def test_iter_fits_images_reads_segmentation_extension(tmp_path):
+    segmap = np.zeros((64, 64), dtype=np.int32)
+    segmap[30:34, 30:34] = 1
+    fits.HDUList([fits.PrimaryHDU(make_galaxy()), fits.ImageHDU(segmap)]).writeto(tmp_path / "gal.fits")
+
+    (name, image, seg_image, header), = iter_fits_images(str(tmp_path), seg_ext=1)
+
+    assert name == "gal"
+    np.testing.assert_array_equal(seg_image, segmap)
+    with pytest.raises(ValueError):
+        next(iter_fits_images(str(tmp_path / "gal.fits"), seg_ext=1))
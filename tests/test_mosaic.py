@@ -0,0 +1,64 @@
+import pytest
+import numpy as np
+
+from galmask.galmask import GalMasker
+from galmask.mosaic import cutout_slices, galmask_mosaic
+
+from tests.helpers import params
+
+
+def make_mosaic():
+    image = np.random.default_rng(0).normal(0, 1, (200, 300))
+    y, x = np.mgrid[:200, :300]
+    centers = [(100, 150), (40, 60), (150, 250), (10, 290)]  # The last one is close to a corner.
+    for cy, cx in centers:
+        image += 100 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * 4 ** 2))
+    return image, centers
+
+def test_cutout_slices():
+    assert cutout_slices((100, 100), (50, 50), 20) == ((slice(40, 60), slice(40, 60)), (10, 10))
+    assert cutout_slices((100, 100), (5, 98), (20, 10)) == ((slice(0, 15), slice(93, 100)), (5, 5))
+
+@pytest.mark.filterwarnings("ignore::photutils.utils.exceptions.NoDetectionsWarning")
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_mosaic_matches_cutout_masks(executor):
+    image, centers = make_mosaic()
+    mosaic_params = {**params, "remove_local_max": False}
+
+    labels, failures = galmask_mosaic(image, centers + [(100, 20)], 64, n_jobs=2, executor=executor, max_pending=2, **mosaic_params)
+
+    assert labels.shape == image.shape
+    assert list(failures) == [4]  # No source at this position.
+    masker = GalMasker(**mosaic_params)
+    for index, center in enumerate(centers):
+        bbox, cutout_center = cutout_slices(image.shape, center, 64)
+        expected = masker.mask(image[bbox], center=cutout_center).astype(bool)
+        np.testing.assert_array_equal(labels[bbox] == index + 1, expected)
+        assert labels[center] == index + 1
+    assert set(np.unique(labels)) == {0, 1, 2, 3, 4}
+
+def test_mosaic_writes_into_out():
+    image, centers = make_mosaic()
+    out = np.zeros(image.shape, dtype=np.int64)
+
+    labels, failures = galmask_mosaic(image, centers, 64, n_jobs=1, out=out, **{**params, "remove_local_max": False})
+
+    assert labels is out and not failures
+    assert all(out[center] == index + 1 for index, center in enumerate(centers))
+
+def test_overlaps_are_resolved_by_catalog_index():
+    image = np.random.default_rng(0).normal(0, 1, (100, 100))
+    y, x = np.mgrid[:100, :100]
+    image += 100 * np.exp(-((x - 50) ** 2 + (y - 50) ** 2) / (2 * 6 ** 2))
+    centers = [(55, 50), (45, 50)]  # The same galaxy, the second position on an earlier row.
+
+    labels, failures = galmask_mosaic(image, centers, 80, n_jobs=1, **{**params, "remove_local_max": False})
+
+    assert not failures
+    masks = []
+    for center in centers:
+        bbox, cutout_center = cutout_slices(image.shape, center, 80)
+        masks.append(np.zeros(image.shape, dtype=bool))
+        masks[-1][bbox] = GalMasker(**{**params, "remove_local_max": False}).mask(image[bbox], center=cutout_center)
+    assert (masks[0] & masks[1]).any()
+    np.testing.assert_array_equal(labels, np.where(masks[0], 1, np.where(masks[1], 2, 0)))
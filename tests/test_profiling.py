@@ -0,0 +1,59 @@
+import csv
+import io
+import json
+import pytest
+import tracemalloc
+import numpy as np
+
+from galmask.batch import galmask_batch
+from galmask.galmask import galmask
+from galmask.profiling import SUMMARY_FIELDS, StageProfiler
+
+from tests.helpers import make_galaxy, params
+
+
+def test_profiler_records_all_stages():
+    calls = []
+    profiler = StageProfiler(track_memory=True, callback=lambda *args: calls.append(args))
+
+    for seed in range(3):
+        galmask(make_galaxy(seed=seed), profiler=profiler, **params)
+
+    summary = {row["stage"]: row for row in profiler.summary()}
+    assert list(summary) == ["background", "convolve", "detect", "deblend", "local_max", "connected_components", "select", "apply"]
+    for row in summary.values():
+        assert row["count"] == 3
+        assert 0 <= row["p50"] <= row["p95"] <= row["max"] <= row["total"]
+        assert row["max_memory"] >= 0
+    assert len(calls) == 3 * len(summary)
+
+    assert [row["stage"] for row in json.loads(profiler.to_json())] == list(summary)
+    rows = list(csv.DictReader(io.StringIO(profiler.to_csv())))
+    assert tuple(rows[0]) == SUMMARY_FIELDS and len(rows) == len(summary)
+
+def test_profiler_only_traces_memory_during_stages():
+    profiler = StageProfiler(track_memory=True)
+    assert not tracemalloc.is_tracing()
+
+    galmask(make_galaxy(), profiler=profiler, **params)
+    assert not tracemalloc.is_tracing()
+
+    tracemalloc.start()  # Tracing started by someone else is left on.
+    try:
+        galmask(make_galaxy(), profiler=profiler, **params)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+@pytest.mark.filterwarnings("ignore::photutils.utils.exceptions.NoDetectionsWarning")
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_profiler_aggregates_batch_calls(executor):
+    profiler = StageProfiler()
+    images = [make_galaxy(seed=seed) for seed in range(4)] + [np.random.default_rng(0).normal(size=(64, 64))]
+
+    galmask_batch(images, n_jobs=2, executor=executor, profiler=profiler, **params)
+
+    summary = {row["stage"]: row for row in profiler.summary()}
+    assert summary["detect"]["count"] == 5
+    assert summary["apply"]["count"] == 4  # The image without detection fails before this stage.
+    assert summary["apply"]["max_memory"] is None
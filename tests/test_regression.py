@@ -0,0 +1,195 @@
+"""Golden-output regression tests.
+
+The masks of synthetic and real fields, for every mode and with and without deblending, are compared against the
+masks stored in `data/golden_masks.npz`, and each engine variant (convolution method, stack engine, reference
+`regionprops`/`peak_local_max` implementations of the label selection and peak finding) must give the same masks.
+Each call must also stay within a memory ceiling and, when the `GALMASK_TIME_CEILINGS` environment variable is set
+to 1, within a wall time ceiling, so that performance work can land without silently changing the masks. Wall times
+depend on the machine and its load, so they are only checked on request, e.g. on a dedicated benchmark runner. After
+an intended change of the masks, regenerate the golden file with:
+
+    python -m tests.test_regression
+"""
+import os
+import time
+import tracemalloc
+from functools import lru_cache
+
+import pytest
+import numpy as np
+from astropy.io import fits
+from skimage.feature import peak_local_max
+from skimage.measure import regionprops
+
+import galmask.galmask
+import galmask.utils
+from galmask.galmask import GalMasker
+from galmask.utils import find_closest_label, pack_mask, unpack_mask
+
+from tests.helpers import make_crowded_galaxy, make_galaxy, params
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+example_dir = os.path.join(current_dir, os.pardir, "example")
+GOLDEN_FILE = os.path.join(current_dir, "data/golden_masks.npz")
+
+REAL_PARAMS = dict(
+    npixels=5, nlevels=32, nsigma=2., contrast=0.15, min_distance=1, num_peaks=10, num_peaks_per_label=3, connectivity=4
+)
+FIELDS = ("isolated", "crowded", "gal1_G", "gal2_R")
+MODES = ("0", "1", "2")
+DEBLEND = (False, True)
+CONVOLVE_METHODS = ("direct", "fft", "separable", "opencv")
+# Wall time ceilings in seconds of a single call without and with deblending, a few times the time measured on a
+# laptop, only checked if `GALMASK_TIME_CEILINGS` is 1, and peak traced memory ceilings in units of the image size.
+CHECK_TIME_CEILINGS = os.environ.get("GALMASK_TIME_CEILINGS") == "1"
+TIME_CEILINGS = {"isolated": (0.5, 1.0), "crowded": (1.0, 2.0), "gal1_G": (1.0, 5.0), "gal2_R": (2.0, 15.0)}
+MEMORY_CEILING = 10
+
+
+@lru_cache(maxsize=None)
+def load_field(name):
+    """Image of a field and the galmask parameters used for it, read-only."""
+    if name == "isolated":
+        image, field_params = make_galaxy(), params
+    elif name == "crowded":
+        image, field_params = make_crowded_galaxy(), params
+    else:
+        image = fits.getdata(os.path.join(example_dir, f"{name}.fits")).astype(float)
+        field_params = {**REAL_PARAMS, "kernel": fits.getdata(os.path.join(example_dir, "kernel.fits"))}
+    image.flags.writeable = False
+    return image, field_params
+
+def make_masker(field, mode, deblend, **kwargs):
+    field_params = {**load_field(field)[1], "deblend": deblend, **kwargs}
+    return GalMasker(mode=mode, mask_dtype=bool, **field_params)
+
+def golden_key(field, mode, deblend):
+    return f"{field}/mode{mode}/deblend{int(deblend)}"
+
+@lru_cache(maxsize=None)
+def load_golden():
+    with np.load(GOLDEN_FILE) as npz:
+        return dict(npz)
+
+def golden_mask(field, mode, deblend):
+    width = load_field(field)[0].shape[1]
+    return unpack_mask(load_golden()[golden_key(field, mode, deblend)], width)
+
+def write_golden():
+    """Recompute the golden masks with the default engines and write them to `GOLDEN_FILE`."""
+    masks = {}
+    for field in FIELDS:
+        for mode in MODES:
+            for deblend in DEBLEND:
+                masks[golden_key(field, mode, deblend)] = pack_mask(make_masker(field, mode, deblend).mask(load_field(field)[0]))
+    np.savez_compressed(GOLDEN_FILE, **masks)
+
+def regionprops_center_label_region(objects, center=None, dtype=float):
+    """Reference implementation of `galmask.utils.getCenterLabelRegion` with `skimage.measure.regionprops`."""
+    props = regionprops(objects)
+    if not props:
+        raise ValueError("The segmentation map does not contain any source.")
+    if center is None:
+        center = (objects.shape[0]/2, objects.shape[1]/2)
+    closest = props[find_closest_label(np.array([prop.centroid for prop in props]), *center) - 1]
+    return (objects == closest.label).astype(dtype)
+
+def peak_local_max_label_peaks(image, labels, min_distance, num_peaks, num_peaks_per_label):
+    """Reference implementation of `galmask.utils.find_label_peaks` with `skimage.feature.peak_local_max`."""
+    return peak_local_max(
+        image, min_distance=min_distance, num_peaks=num_peaks, num_peaks_per_label=num_peaks_per_label, labels=labels
+    )
+
+
+@pytest.fixture(scope="module", autouse=True)
+def warm_up():
+    """Perform the lazy imports and first-call initializations before any call is timed."""
+    for mode in MODES:
+        make_masker("isolated", mode, True).mask(load_field("isolated")[0])
+
+
+@pytest.mark.parametrize("deblend", DEBLEND)
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("field", FIELDS)
+def test_golden_masks(field, mode, deblend):
+    mask = make_masker(field, mode, deblend).mask(load_field(field)[0])
+
+    np.testing.assert_array_equal(mask, golden_mask(field, mode, deblend))
+
+@pytest.mark.skipif(not CHECK_TIME_CEILINGS, reason="Wall time ceilings are only checked if GALMASK_TIME_CEILINGS=1.")
+@pytest.mark.parametrize("deblend", DEBLEND)
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("field", FIELDS)
+def test_time_ceiling(field, mode, deblend):
+    image = load_field(field)[0]
+    masker = make_masker(field, mode, deblend)
+
+    start = time.perf_counter()
+    masker.mask(image)
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < TIME_CEILINGS[field][deblend], f"{elapsed:.2f} s"
+
+@pytest.mark.parametrize("deblend", DEBLEND)
+@pytest.mark.parametrize("mode", MODES)
+@pytest.mark.parametrize("field", FIELDS)
+def test_memory_ceiling(field, mode, deblend):
+    if deblend and field in ("gal1_G", "gal2_R"):
+        pytest.skip("Deblending large fields is slow under tracemalloc; its memory is covered by the synthetic fields.")
+    image = load_field(field)[0]
+    masker = make_masker(field, mode, deblend)
+    masker.mask(image)  # Excludes the lazy imports and caches filled by the first call.
+
+    # Memory may already be traced, e.g. by pytest plugins, in which case tracing is left on.
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    if hasattr(tracemalloc, "reset_peak"):  # Python >= 3.9
+        tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    try:
+        masker.mask(image)
+        peak_memory = tracemalloc.get_traced_memory()[1] - start_memory
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    assert peak_memory < MEMORY_CEILING * image.nbytes, f"{peak_memory / image.nbytes:.1f} times the image size"
+
+def engine_cases():
+    for field in FIELDS:
+        for deblend in DEBLEND:
+            if deblend and field in ("gal1_G", "gal2_R"):  # Engines are independent of deblending, which is slow here.
+                continue
+            for mode in MODES:
+                yield field, mode, deblend
+
+@pytest.mark.parametrize("convolve_method", CONVOLVE_METHODS)
+@pytest.mark.parametrize("field, mode, deblend", list(engine_cases()))
+def test_convolution_engines_match_golden_masks(field, mode, deblend, convolve_method):
+    if convolve_method == "separable" and np.linalg.matrix_rank(make_masker(field, mode, deblend).kernel) > 1:
+        pytest.skip("The kernel is not separable.")
+    mask = make_masker(field, mode, deblend, convolve_method=convolve_method).mask(load_field(field)[0])
+
+    np.testing.assert_array_equal(mask, golden_mask(field, mode, deblend))
+
+@pytest.mark.parametrize("field, mode, deblend", list(engine_cases()))
+def test_reference_selection_and_peaks_match_golden_masks(monkeypatch, field, mode, deblend):
+    monkeypatch.setattr(galmask.galmask, "getCenterLabelRegion", regionprops_center_label_region)
+    monkeypatch.setattr(galmask.utils, "find_label_peaks", peak_local_max_label_peaks)
+
+    mask = make_masker(field, mode, deblend).mask(load_field(field)[0])
+
+    np.testing.assert_array_equal(mask, golden_mask(field, mode, deblend))
+
+@pytest.mark.parametrize("deblend", DEBLEND)
+@pytest.mark.parametrize("mode", MODES)
+def test_stack_engine_matches_golden_masks(mode, deblend):
+    masks = make_masker("isolated", mode, deblend).mask_stack(np.stack([load_field("isolated")[0]] * 3))[1]
+
+    for mask in masks:
+        np.testing.assert_array_equal(mask, golden_mask("isolated", mode, deblend))
+
+
+if __name__ == "__main__":
+    write_golden()
@@ -2,8 +2,15 @@ import os
 import pytest
 import numpy as np
 from astropy.io import fits
+from scipy import ndimage
+from skimage.feature import peak_local_max
+from skimage.measure import regionprops
+from photutils.segmentation import detect_sources
 
-from galmask.utils import find_closest_label, find_farthest_label, getLargestCC, getCenterLabelRegion
+from galmask.utils import (
+    find_central_labels, find_closest_label, find_farthest_label, getLargestCC, getCenterBoundingBox, getCenterLabelRegion, label_stack, label_stats,
+    mask_bounding_box, pack_mask, unpack_mask, encode_rle, decode_rle, find_label_peaks, find_farthest_peak_labels
+)
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -98,3 +105,100 @@ def test_getCenterLabelRegion_segmap():  # This is just an additional test on an
     assert xindices.min() < 212
     assert yindices.max() > 156
     assert yindices.min() < 204
+
+def test_label_stats_matches_regionprops():
+    segmap = fits.getdata(os.path.join(current_dir, 'data/test_getCenterLabelRegion_segmap.fits')).astype(int)
+    label_ids, areas, centroids = label_stats(segmap)
+    props = regionprops(segmap)
+
+    np.testing.assert_array_equal(label_ids, [prop.label for prop in props])
+    np.testing.assert_array_equal(areas, [prop.area for prop in props])
+    np.testing.assert_allclose(centroids, [prop.centroid for prop in props])
+
+def test_label_stats_of_huge_label_ids():
+    segmap = np.zeros((50, 50), dtype=np.int64)
+    segmap[23:27, 23:27] = 10**12
+    segmap[35:48, 35:48] = 3
+    label_ids, areas, centroids = label_stats(segmap)
+
+    np.testing.assert_array_equal(label_ids, [3, 10**12])
+    np.testing.assert_array_equal(areas, [169, 16])
+    np.testing.assert_allclose(centroids, [[41, 41], [24.5, 24.5]])
+    np.testing.assert_array_equal(getCenterLabelRegion(segmap), (segmap == 10**12).astype(float))
+
+def test_getCenterLabelRegion_non_contiguous_labels():
+    segmap = np.zeros((50, 50), dtype=int)
+    segmap[23:27, 23:27] = 7
+    segmap[35:48, 35:48] = 3
+    final_segmap = getCenterLabelRegion(segmap)
+
+    np.testing.assert_array_equal(final_segmap, (segmap == 7).astype(float))
+    with pytest.raises(ValueError):
+        getCenterLabelRegion(np.zeros((50, 50), dtype=int))
+
+def test_getCenterBoundingBox():
+    segmap = np.zeros((50, 50), dtype=int)
+    segmap[24:27, 10:27] = 1  # Covers the center.
+    segmap[28:31, 24:28] = 2  # Closest centroid.
+    segmap[40:45, 2:10] = 3
+
+    np.testing.assert_array_equal(find_central_labels(segmap), [1, 2])
+    np.testing.assert_array_equal(find_central_labels(segmap, center=(42, 5)), [3])
+    assert getCenterBoundingBox(segmap) == (slice(24, 31), slice(10, 28))
+    assert getCenterBoundingBox(segmap, pad=21) == (slice(3, 50), slice(0, 49))
+
+@pytest.mark.filterwarnings("ignore::photutils.utils.exceptions.NoDetectionsWarning")
+@pytest.mark.parametrize("connectivity", [4, 8])
+def test_label_stack_matches_detect_sources(connectivity):
+    stack = np.random.default_rng(0).normal(size=(10, 40, 40))
+    stack[3] = -1  # No source.
+
+    labels = label_stack(stack > 1.0, 5, connectivity=connectivity)
+
+    for image, image_labels in zip(stack, labels):
+        segm = detect_sources(image, 1.0, 5, connectivity=connectivity)
+        np.testing.assert_array_equal(image_labels, 0 if segm is None else segm.data)
+
+def test_compact_mask_encodings():
+    mask = np.random.default_rng(0).random((37, 29)) > 0.6
+    mask[0, 0] = mask[-1, -1] = True
+
+    packed = pack_mask(mask)
+    assert packed.shape == (37, 4)
+    np.testing.assert_array_equal(unpack_mask(packed, 29), mask)
+
+    runs = encode_rle(mask)
+    assert runs[0, 0] == 0 and runs[-1].sum() == mask.size
+    np.testing.assert_array_equal(decode_rle(runs, mask.shape), mask)
+    np.testing.assert_array_equal(decode_rle(encode_rle(np.zeros((3, 3))), (3, 3)), np.zeros((3, 3), dtype=bool))
+
+def test_mask_bounding_box():
+    mask = np.zeros((20, 30), dtype=bool)
+    mask[5:8, 10:20] = True
+
+    assert mask_bounding_box(mask) == (slice(5, 8), slice(10, 20))
+    assert mask_bounding_box(mask, pad=6) == (slice(0, 14), slice(4, 26))
+    assert mask_bounding_box(np.zeros((4, 4))) is None
+
+@pytest.mark.parametrize("shape", [(60, 70), (150, 160)])
+@pytest.mark.parametrize("num_peaks,num_peaks_per_label", [(10, 3), (5, 1), (1000, 1000), (np.inf, np.inf)])
+def test_find_label_peaks_matches_peak_local_max(shape, num_peaks, num_peaks_per_label):
+    for seed, plateau in ((0, False), (1, True)):
+        image = ndimage.gaussian_filter(np.random.default_rng(seed).normal(size=shape), 1)
+        if plateau:  # Ties and flat labels.
+            image = np.round(image, 1)
+            image[10:14, 10:14] = 1.0
+        labels = detect_sources(image, 0.05, npixels=3).data
+
+        expected = peak_local_max(image, min_distance=1, num_peaks=num_peaks, num_peaks_per_label=num_peaks_per_label, labels=labels)
+        np.testing.assert_array_equal(find_label_peaks(image, labels, 1, num_peaks, num_peaks_per_label), expected)
+
+def test_find_farthest_peak_labels():
+    labels = np.zeros((50, 50), dtype=int)
+    labels[23:28, 23:28], labels[2:7, 40:45], labels[40:45, 2:7], labels[20:25, 40:45] = 1, 2, 3, 4
+    image = ndimage.gaussian_filter((labels > 0).astype(float), 1) + 0.01 * (labels > 0)
+
+    local_max = find_label_peaks(image, labels, 1, 10, 3)
+    farthest = find_farthest_peak_labels(image, labels, (25, 25), 1, 10, 3)
+    assert farthest.tolist() == [labels[tuple(local_max[find_farthest_label(local_max, 25, 25)])]]
+    assert find_farthest_peak_labels(image, labels, (25, 25), 1, 10, 3, n_labels=3).tolist() == [2, 3, 4]  # Labels 2 and 3 are equally far.